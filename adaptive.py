@@ -0,0 +1,162 @@
+import numpy as np
+
+from expression import evaluate_function, evaluate_z
+
+# Maximum number of evaluated points per function
+DEFAULT_POINT_BUDGET = 10000
+
+# Cells per axis of the starting grid, and how many times a cell may be split in four
+BASE_CELLS = 16
+MAX_DEPTH = 6
+
+# Largest change of log-magnitude, or of phase in π units, accepted across a cell
+TOLERANCE = 0.05
+
+# Upper bound on the points added by splitting one cell (centre and four edge midpoints)
+POINTS_PER_SPLIT = 5
+
+
+def cell_error(corners):
+    # corners has shape (4, cells) in the order (i0, j0), (i1, j0), (i1, j1), (i0, j1).
+    # Error is the larger of the log-magnitude spread and the largest phase jump along an edge.
+    with np.errstate(all='ignore'):
+        log_magnitude = np.log1p(np.abs(corners))
+        magnitude_error = log_magnitude.max(axis=0) - log_magnitude.min(axis=0)
+
+        edges = corners * np.conj(np.roll(corners, 1, axis=0))
+        phase_error = np.abs(np.angle(edges)).max(axis=0) / np.pi
+
+        error = np.maximum(magnitude_error, phase_error)
+
+    # Poles, overflows and branch points always ask for refinement (up to MAX_DEPTH)
+    error[~np.isfinite(corners).all(axis=0)] = np.inf
+    return error
+
+
+class AdaptiveSampler:
+    # Samples f on a quadtree: cells whose magnitude or phase varies too much are split,
+    # worst cells first, until nothing exceeds the tolerance or the point budget is spent.
+    # Points live on an integer lattice so shared corners are evaluated only once.
+
+    def __init__(self, function, z_function, x_min, x_max, y_min, y_max,
+                 budget=DEFAULT_POINT_BUDGET, base=BASE_CELLS, max_depth=MAX_DEPTH, tolerance=TOLERANCE, backend='numpy',
+                 parameters=None):
+        self.function = function
+        self.z_function = z_function
+        self.backend = backend
+        self.parameters = parameters
+        self.x_min, self.x_max = x_min, x_max
+        self.y_min, self.y_max = y_min, y_max
+        self.budget = budget
+        self.max_depth = max_depth
+        self.tolerance = tolerance
+
+        self.cell_size = 2 ** max_depth
+        self.size = base * self.cell_size
+
+        self.index = {}
+        self.i = np.empty(0, dtype=np.int64)
+        self.j = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=complex)
+
+    def key(self, i, j):
+        return i * (self.size + 1) + j
+
+    def add_points(self, i, j):
+        # Evaluate the lattice points that are not known yet
+        keys = self.key(i, j)
+        keys, first = np.unique(keys, return_index=True)
+        new = np.fromiter((key not in self.index for key in keys.tolist()), dtype=bool, count=len(keys))
+        if not new.any():
+            return
+
+        i, j = i[first][new], j[first][new]
+        x = self.x_min + (self.x_max - self.x_min) * i / self.size
+        y = self.y_min + (self.y_max - self.y_min) * j / self.size
+        Z = evaluate_z(self.z_function, x, y, self.parameters)
+        values = evaluate_function(self.function, Z, self.backend, self.parameters)
+
+        start = len(self.values)
+        for offset, key in enumerate(keys[new].tolist()):
+            self.index[key] = start + offset
+        self.i = np.concatenate([self.i, i])
+        self.j = np.concatenate([self.j, j])
+        self.values = np.concatenate([self.values, values.astype(complex, copy=False)])
+
+    def lookup(self, i, j):
+        keys = self.key(i, j).tolist()
+        return self.values[np.fromiter((self.index[key] for key in keys), dtype=np.int64, count=len(keys))]
+
+    def sample(self, is_cancelled=None):
+        base = self.size // self.cell_size
+        cell_i, cell_j = np.meshgrid(np.arange(base) * self.cell_size, np.arange(base) * self.cell_size, indexing='ij')
+        cell_i, cell_j = cell_i.ravel(), cell_j.ravel()
+        cell_level = np.zeros(len(cell_i), dtype=np.int64)
+
+        lattice = np.arange(base + 1) * self.cell_size
+        grid_i, grid_j = np.meshgrid(lattice, lattice, indexing='ij')
+        self.add_points(grid_i.ravel(), grid_j.ravel())
+
+        while True:
+            if is_cancelled is not None and is_cancelled():
+                return None
+
+            step = self.cell_size >> cell_level
+            corners = np.stack([
+                self.lookup(cell_i, cell_j),
+                self.lookup(cell_i + step, cell_j),
+                self.lookup(cell_i + step, cell_j + step),
+                self.lookup(cell_i, cell_j + step),
+            ])
+            error = cell_error(corners)
+            error[(cell_level >= self.max_depth) | (error <= self.tolerance)] = -1
+
+            splits = min(int((error > 0).sum()), (self.budget - len(self.values)) // POINTS_PER_SPLIT)
+            if splits <= 0:
+                break
+
+            # Split the worst cells into four children
+            split = np.zeros(len(error), dtype=bool)
+            split[np.argsort(-error, kind='stable')[:splits]] = True
+
+            i0, j0 = cell_i[split], cell_j[split]
+            half = step[split] // 2
+            level = cell_level[split] + 1
+
+            self.add_points(
+                np.concatenate([i0 + half, i0 + half, i0 + half, i0, i0 + 2 * half]),
+                np.concatenate([j0 + half, j0, j0 + 2 * half, j0 + half, j0 + half])
+            )
+
+            cell_i = np.concatenate([cell_i[~split], i0, i0 + half, i0, i0 + half])
+            cell_j = np.concatenate([cell_j[~split], j0, j0, j0 + half, j0 + half])
+            cell_level = np.concatenate([cell_level[~split], level, level, level, level])
+
+        return self.mesh()
+
+    def mesh(self):
+        # Delaunay on the integer lattice coordinates joins the quadtree cells without cracks
+        from scipy.spatial import Delaunay
+
+        triangles = Delaunay(np.column_stack([self.i, self.j]).astype(float)).simplices
+        # Vertex indices are sent as uint16 whenever they fit, halving the triangle payload
+        triangles = triangles.astype(np.uint16 if len(self.values) <= 65536 else np.uint32)
+        return dict(
+            x=self.x_min + (self.x_max - self.x_min) * self.i / self.size,
+            y=self.y_min + (self.y_max - self.y_min) * self.j / self.size,
+            F=self.values,
+            i=np.ascontiguousarray(triangles[:, 0]),
+            j=np.ascontiguousarray(triangles[:, 1]),
+            k=np.ascontiguousarray(triangles[:, 2])
+        )
+
+
+def adaptive_mesh(function, z_function, settings, is_cancelled=None):
+    sampler = AdaptiveSampler(
+        function, z_function,
+        settings['x_min'], settings['x_max'], settings['y_min'], settings['y_max'],
+        budget=settings['point_budget'],
+        backend=settings['backend'],
+        parameters=settings['parameters']
+    )
+    return sampler.sample(is_cancelled)
@@ -0,0 +1,283 @@
+import threading
+
+# Plot pages, plotly.js and figure data are served from memory under this scheme and host
+SCHEME = 'complexplot'
+HOST = 'plots'
+
+# Revisions of a path kept until the page has fetched them; older ones are dropped
+MAX_UNFETCHED_REVISIONS = 8
+
+# Page loaded once per view; later updates fetch new figure data into it
+BOOTSTRAP_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+html, body { margin: 0; width: 100%; height: 100%; overflow: hidden; background: #121212; }
+#plot { width: 100%; height: 100%; }
+</style>
+<script src="plotly.min.js"></script>
+</head>
+<body>
+<div id="plot"></div>
+<script>
+var plot = document.getElementById('plot');
+var revision = 0;
+// Traces of the latest figure received; {"keep": i} in an update refers to trace i of it.
+// Updates are applied in order, so the references always resolve against the one before.
+var traces = [];
+var queue = Promise.resolve();
+function loadPlot(url) {
+    var start = performance.now();
+    var current = ++revision;
+    var response = fetch(url).then(function (response) {
+        return response.json();
+    });
+    queue = queue.then(function () {
+        return response;
+    }).then(function (figure) {
+        traces = figure.data.map(function (trace) {
+            return trace.keep === undefined ? trace : traces[trace.keep];
+        });
+        // A newer update may have been requested while this one was in flight
+        if (current !== revision) {
+            return;
+        }
+        var fetched = performance.now();
+        // Kept traces are the same objects as before, so Plotly.react leaves their data alone
+        return Plotly.react(plot, traces.slice(), figure.layout, {responsive: true}).then(function () {
+            var done = performance.now();
+            console.log('redraw ' + (fetched - start).toFixed(1) + ' ' + (done - fetched).toFixed(1));
+        });
+    }).catch(function (error) {
+        console.error('plot update failed: ' + error);
+    });
+}
+</script>
+</body>
+</html>
+"""
+
+# Browser client of the web server (server.py): inputs on the left, the four plots on the right.
+# Results arrive over the WebSocket as binary messages (see transport.pack_message), whose arrays
+# are handed to plotly.js as typed array specs without any base64 step.
+SERVER_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Complex Function Plots</title>
+<style>
+html, body { margin: 0; height: 100%; background: #121212; color: #e0e0e0; font: 10pt Arial, sans-serif; }
+body { display: flex; }
+#inputs { width: 220px; padding: 8px; display: flex; flex-direction: column; gap: 6px; }
+#inputs input, #inputs textarea, #inputs select, #inputs button {
+    background: #1e1e1e; color: #e0e0e0; border: 1px solid #555; border-radius: 5px; padding: 4px;
+}
+#inputs textarea { height: 90px; }
+.range { display: flex; gap: 4px; }
+.range input { width: 0; flex: 1; }
+#status { color: #aaa; font-size: 9pt; word-break: break-word; }
+#plots { flex: 1; display: grid; grid-template: 1fr 1fr / 1fr 1fr; }
+#plots div { min-width: 0; min-height: 0; }
+</style>
+<script src="plotly.min.js"></script>
+</head>
+<body>
+<div id="inputs">
+<label>z = <input id="z_function" placeholder="X + 1j * Y"></label>
+<label>f(z), one per line<textarea id="functions">sin(z) / z</textarea></label>
+<div class="range">X <input id="x_min" placeholder="Min"><input id="x_max" placeholder="Max"></div>
+<div class="range">Y <input id="y_min" placeholder="Min"><input id="y_max" placeholder="Max"></div>
+<div class="range">Z <input id="z_min" placeholder="Min"><input id="z_max" placeholder="Max"></div>
+<label>Res <input id="resolution" type="number" value="200" min="10"></label>
+<label>Levels <input id="levels" type="number" value="3" min="1" max="5"></label>
+<label>Magnitude <select id="magnitude_view"><option>surface</option><option>domain</option></select></label>
+<button id="update">Update Function</button>
+<div id="status">Connecting...</div>
+</div>
+<div id="plots">
+<div id="magnitude"></div><div id="imaginary_part"></div>
+<div id="real_part"></div><div id="real_function"></div>
+</div>
+<script>
+var VIEWS = ['magnitude', 'imaginary_part', 'real_part', 'real_function'];
+var NUMBERS = ['x_min', 'x_max', 'y_min', 'y_max', 'z_min', 'z_max', 'resolution', 'levels'];
+var status = document.getElementById('status');
+var decoder = new TextDecoder();
+var socket = null;
+var latest = 0;
+
+function readSettings() {
+    var settings = {
+        z_function: document.getElementById('z_function').value,
+        functions: document.getElementById('functions').value.split('\\n').filter(function (line) {
+            return line.trim();
+        }),
+        magnitude_view: document.getElementById('magnitude_view').value
+    };
+    NUMBERS.forEach(function (name) {
+        var text = document.getElementById(name).value.trim();
+        if (text) {
+            settings[name] = name === 'resolution' || name === 'levels' ? parseInt(text) : parseFloat(text);
+        }
+    });
+    return settings;
+}
+
+function decode(buffer) {
+    // <meta length><meta><document length><document><array bytes>; arrays in the document
+    // refer to their bytes by offset and length
+    var view = new DataView(buffer);
+    var metaLength = view.getUint32(0, true);
+    var meta = JSON.parse(decoder.decode(new Uint8Array(buffer, 4, metaLength)));
+    var documentStart = 8 + metaLength;
+    var documentLength = view.getUint32(4 + metaLength, true);
+    var dataStart = documentStart + documentLength;
+    var figures = JSON.parse(decoder.decode(new Uint8Array(buffer, documentStart, documentLength)), function (key, value) {
+        if (value && typeof value === 'object' && value.dtype !== undefined && value.offset !== undefined) {
+            var start = dataStart + value.offset;
+            var spec = {dtype: value.dtype, bdata: buffer.slice(start, start + value.length)};
+            if (value.shape !== undefined) {
+                spec.shape = value.shape;
+            }
+            return spec;
+        }
+        return value;
+    });
+    return {meta: meta, figures: figures};
+}
+
+function show(buffer) {
+    var message = decode(buffer);
+    var meta = message.meta;
+    if (meta.id !== latest) {
+        return;
+    }
+    VIEWS.forEach(function (name) {
+        var figure = message.figures[name];
+        Plotly.react(name, figure.data, figure.layout, {responsive: true});
+    });
+    var timings = Object.keys(meta.timings).map(function (stage) {
+        return stage + ' ' + meta.timings[stage].toFixed(1) + ' ms';
+    }).join(' \u00b7 ');
+    var vertices = meta.vertices.computed ? ', vertices: ' + meta.vertices.sent + ' of ' + meta.vertices.computed : '';
+    status.textContent = meta.resolution + 'x' + meta.resolution + ' (pass ' + meta.level + '/' + meta.levels + ', '
+        + meta.source + '), ' + (buffer.byteLength / 1e6).toFixed(2) + ' MB' + vertices + ' | ' + timings;
+}
+
+function update() {
+    if (!socket || socket.readyState !== WebSocket.OPEN) {
+        return;
+    }
+    latest += 1;
+    socket.send(JSON.stringify({id: latest, settings: readSettings()}));
+}
+
+function connect() {
+    var scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+    socket = new WebSocket(scheme + location.host + '/ws');
+    socket.binaryType = 'arraybuffer';
+    socket.onopen = function () {
+        status.textContent = 'Connected';
+        update();
+    };
+    socket.onmessage = function (event) {
+        if (typeof event.data === 'string') {
+            var reply = JSON.parse(event.data);
+            if (reply.id === latest) {
+                status.textContent = 'Error: ' + reply.error;
+            }
+            return;
+        }
+        show(event.data);
+    };
+    socket.onclose = function () {
+        status.textContent = 'Disconnected, reconnecting...';
+        setTimeout(connect, 1000);
+    };
+}
+
+document.getElementById('update').onclick = update;
+document.getElementById('inputs').addEventListener('keydown', function (event) {
+    if (event.key === 'Enter' && event.target.tagName === 'INPUT') {
+        update();
+    }
+});
+connect();
+</script>
+</body>
+</html>
+"""
+
+
+class AssetStore:
+    # In-memory files served to the web views. Each path holds its latest content, plus every
+    # revision handed out by url() until it has been fetched once: a page that is still
+    # fetching an older figure gets exactly that one, never a newer blob whose {"keep": i}
+    # references assume a different figure before it. Memory stays flat however many updates
+    # are pushed, since fetched revisions are dropped and at most MAX_UNFETCHED_REVISIONS wait.
+
+    def __init__(self):
+        self.assets = {}
+        self.revisions = {}
+        self.unfetched = {}
+        self.lock = threading.Lock()
+
+    def put(self, path, mime_type, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.lock:
+            self.assets[path] = (mime_type, data)
+            revision = self.revisions[path] = self.revisions.get(path, 0) + 1
+            waiting = self.unfetched.setdefault(path, {})
+            waiting[revision] = (mime_type, data)
+            while len(waiting) > MAX_UNFETCHED_REVISIONS:
+                del waiting[min(waiting)]
+            return revision
+
+    def get(self, path, revision=None):
+        # The latest content, or the given revision if it has not been fetched yet
+        with self.lock:
+            if revision is None:
+                return self.assets.get(path)
+            return self.unfetched.get(path, {}).pop(revision, None)
+
+    def remove(self, path):
+        with self.lock:
+            self.assets.pop(path, None)
+            self.unfetched.pop(path, None)
+
+    def url(self, path):
+        # Revision in the query string, so an updated asset never hits a stale copy
+        with self.lock:
+            revision = self.revisions.get(path, 0)
+        return f"{SCHEME}://{HOST}{path}?rev={revision}"
+
+    def total_bytes(self):
+        # Revisions waiting to be fetched mostly share their bytes with the latest content
+        with self.lock:
+            blobs = {id(data): data for _, data in self.assets.values()}
+            for waiting in self.unfetched.values():
+                blobs.update((id(data), data) for _, data in waiting.values())
+            return sum(len(data) for data in blobs.values())
+
+    def __contains__(self, path):
+        with self.lock:
+            return path in self.assets
+
+
+def install_static_assets(store):
+    # plotly.js comes from the local plotly package and is encoded only once per process
+    if '/plotly.min.js' not in store:
+        from plotly.offline import get_plotlyjs
+
+        store.put('/plotly.min.js', 'application/javascript', get_plotlyjs())
+        store.put('/index.html', 'text/html', BOOTSTRAP_PAGE)
+
+
+def data_path(view_name):
+    return f"/data/{view_name}.json"
+
+
+# Shared by every web view in this process
+asset_store = AssetStore()
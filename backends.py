@@ -0,0 +1,306 @@
+import ast
+import cmath
+import importlib.util
+import logging
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from expression import FUNCTION_VARIABLES, SAFE_FUNCTIONS, arccot, compile_function, cot
+
+logger = logging.getLogger(__name__)
+
+# Engines that can evaluate the plotted functions; 'auto' picks one per expression
+BACKENDS = ('auto', 'numpy', 'numexpr', 'numba')
+DEFAULT_BACKEND = 'auto'
+
+# Tried in this order by 'auto': numexpr is multithreaded and needs no compilation,
+# numba covers what numexpr cannot express (angle, real-valued math) at a one-off JIT cost
+AUTO_ORDER = ('numexpr', 'numba')
+
+# A kernel is only used if it matches the numpy result on these points
+# (zero, the axes and the unit circle are where branch cuts and poles usually are; the axes
+# inside and beyond the unit circle, from both sides, are where sqrt(z**2 - 1), arcsin, arccos
+# and the like have theirs; on the diagonals even powers land on the negative real axis)
+PROBE_Z = np.array([
+    0, 1, -1, 1j, -1j, 0.5 + 0.5j, -2.5 + 1.5j, 3 - 0.7j, -0.3 - 2j, 1e-3 + 1e-3j, 10 + 10j, -7.25 - 0.125j,
+    2, -2, 2j, -2j, complex(2, -0.0), complex(-2, -0.0), complex(-0.0, 2), complex(-0.0, -2),
+    0.5, -0.5, complex(0.5, -0.0), complex(-0.5, -0.0), -0.98,
+    1 + 1j, 1 - 1j, -1 + 1j, -1 - 1j, 2 - 2j, -2 + 2j
+], dtype=complex)
+PROBE_RTOL = 1e-9
+PROBE_ATOL = 1e-12
+
+# Value kinds tracked while translating, so real inputs keep numpy's real semantics
+# (e.g. sqrt(X) of a negative X is nan, not imaginary)
+REAL, COMPLEX = 'real', 'complex'
+VARIABLE_KINDS = {'z': COMPLEX, 'X': REAL, 'Y': REAL}
+
+
+class Unsupported(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def available_backends():
+    # Checked without importing, numba in particular is slow to import
+    installed = tuple(name for name in AUTO_ORDER if importlib.util.find_spec(name) is not None)
+    return ('auto', 'numpy') + installed
+
+
+def _function_of(node):
+    # The SAFE_FUNCTIONS entry called by node, so both engines translate from the same table
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and len(node.args) == 1 and not node.keywords:
+        return SAFE_FUNCTIONS.get(node.func.id)
+    raise Unsupported(ast.unparse(node))
+
+
+class Translator:
+    # Turns a validated expression tree into source for another engine, tracking for every
+    # subexpression whether numpy would compute it as a real or a complex value
+
+    operators = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.Pow: '**'}
+
+    def translate(self, node):
+        if isinstance(node, ast.Name) and node.id in VARIABLE_KINDS:
+            return node.id, VARIABLE_KINDS[node.id]
+
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, complex)) \
+                and not isinstance(node.value, bool):
+            return self.constant(node.value)
+
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'np' \
+                and node.attr in ('pi', 'e'):
+            return self.constant(getattr(np, node.attr))
+
+        if isinstance(node, ast.Name) and node.id in ('pi', 'e'):
+            return self.constant(SAFE_FUNCTIONS[node.id])
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand, kind = self.translate(node.operand)
+            return f"({'-' if isinstance(node.op, ast.USub) else '+'}{operand})", kind
+
+        if isinstance(node, ast.BinOp) and type(node.op) in self.operators:
+            left, left_kind = self.translate(node.left)
+            right, right_kind = self.translate(node.right)
+            kind = COMPLEX if COMPLEX in (left_kind, right_kind) else REAL
+            return self.binary(self.operators[type(node.op)], left, right, kind), kind
+
+        if isinstance(node, ast.Attribute) and node.attr in ('real', 'imag'):
+            value, kind = self.translate(node.value)
+            return self.part(node.attr, value, kind), REAL
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'conjugate' \
+                and not node.args and not node.keywords:
+            value, kind = self.translate(node.func.value)
+            return self.conjugate(value, kind), kind
+
+        function = _function_of(node)
+        argument, kind = self.translate(node.args[0])
+        return self.call(function, argument, kind)
+
+    def constant(self, value):
+        if isinstance(value, complex):
+            return f"({value.real!r} + {value.imag!r}j)", COMPLEX
+        return repr(value), REAL
+
+    def binary(self, operator, left, right, kind):
+        return f"({left} {operator} {right})"
+
+    def part(self, attr, value, kind):
+        raise NotImplementedError
+
+    def conjugate(self, value, kind):
+        raise NotImplementedError
+
+    def call(self, function, argument, kind):
+        raise NotImplementedError
+
+
+class NumexprTranslator(Translator):
+    functions = {
+        np.sin: 'sin', np.cos: 'cos', np.tan: 'tan', np.sqrt: 'sqrt', np.log: 'log', np.exp: 'exp',
+        np.arctan: 'arctan', np.arccos: 'arccos', np.arcsin: 'arcsin'
+    }
+
+    def part(self, attr, value, kind):
+        if kind == COMPLEX:
+            return f"{attr}({value})"
+        return value if attr == 'real' else f"({value} * 0.0)"
+
+    def conjugate(self, value, kind):
+        return f"conj({value})" if kind == COMPLEX else value
+
+    def call(self, function, argument, kind):
+        if function is np.abs:
+            # numexpr keeps abs of a complex value complex, numpy makes it real
+            return (f"real(abs({argument}))" if kind == COMPLEX else f"abs({argument})"), REAL
+        if function is cot:
+            return f"(1.0 / tan({argument}))", kind
+        if function is arccot:
+            return f"({math.pi / 2!r} - arctan({argument}))", kind
+        if function in self.functions:
+            return f"{self.functions[function]}({argument})", kind
+        raise Unsupported(getattr(function, '__name__', repr(function)))
+
+
+class NumbaTranslator(Translator):
+    # Scalar source for a numba ufunc: math for real values, cmath for complex ones
+    functions = {
+        np.sin: 'sin', np.cos: 'cos', np.tan: 'tan', np.sqrt: 'sqrt', np.log: 'log', np.exp: 'exp',
+        np.arctan: 'atan', np.arccos: 'acos', np.arcsin: 'asin'
+    }
+
+    def binary(self, operator, left, right, kind):
+        # numba raises on complex division by zero, numpy returns inf/nan
+        if operator == '/' and kind == COMPLEX:
+            return f"divide({left}, {right})"
+        # numba's complex power is the general (slow) one, numpy multiplies for integer exponents
+        if operator == '**' and kind == COMPLEX and right.lstrip('(-').rstrip(')').isdigit():
+            exponent = int(right.strip('()'))
+            if exponent >= 0:
+                return f"power({left}, {exponent})"
+            return f"divide(1.0, power({left}, {-exponent}))"
+        return f"({left} {operator} {right})"
+
+    def part(self, attr, value, kind):
+        if kind == COMPLEX:
+            return f"({value}).{attr}"
+        return value if attr == 'real' else "0.0"
+
+    def conjugate(self, value, kind):
+        return f"({value}).conjugate()" if kind == COMPLEX else value
+
+    def call(self, function, argument, kind):
+        module = 'cmath' if kind == COMPLEX else 'math'
+        if function is np.abs:
+            return f"abs({argument})", REAL
+        if function is np.angle:
+            return (f"cmath.phase({argument})" if kind == COMPLEX else f"math.atan2(0.0, {argument})"), REAL
+        if function is cot:
+            return self.binary('/', '1.0', f"{module}.tan({argument})", kind), kind
+        if function is arccot:
+            return f"({math.pi / 2!r} - {module}.atan({argument}))", kind
+        if function in self.functions:
+            return f"{module}.{self.functions[function]}({argument})", kind
+        raise Unsupported(getattr(function, '__name__', repr(function)))
+
+
+def _numexpr_kernel(tree):
+    import numexpr
+
+    source, kind = NumexprTranslator().translate(tree)
+    # Validates the expression once; evaluate() reuses numexpr's own compiled cache
+    numexpr.validate(source, local_dict=dict(z=PROBE_Z, X=PROBE_Z.real, Y=PROBE_Z.imag))
+
+    def kernel(z, X, Y):
+        result = numexpr.evaluate(source, local_dict=dict(z=z, X=X, Y=Y), global_dict={})
+        return result.real if kind == REAL and np.iscomplexobj(result) else result
+
+    return kernel
+
+
+@lru_cache(maxsize=None)
+def _numba_helpers():
+    import numba
+
+    @numba.njit(error_model='numpy')
+    def divide(a, b):
+        if b == 0:
+            return complex(a) * math.inf
+        return a / b
+
+    @numba.njit(error_model='numpy')
+    def power(a, n):
+        # The same products in the same order as numpy's complex power for small integer
+        # exponents, so even the signs of zero parts match (z**2 of -0.98+0j is 0.9604-0j):
+        # exponents up to 3 are multiplied out, larger ones by binary exponentiation from 1
+        a = complex(a)
+        if n == 1:
+            return a
+        if n == 2:
+            return a * a
+        if n == 3:
+            return (a * a) * a
+        result = complex(1.0)
+        mask = 1
+        while mask <= n:
+            if n & mask:
+                result *= a
+            mask <<= 1
+            a *= a
+        return result
+
+    return dict(divide=divide, power=power)
+
+
+def _numba_kernel(tree):
+    import numba
+
+    source, kind = NumbaTranslator().translate(tree)
+    namespace = dict(math=math, cmath=cmath, **_numba_helpers())
+    exec(f"def scalar(z, X, Y):\n    return {source}\n", namespace)
+
+    # The numpy error model makes real division by zero give inf/nan instead of raising
+    scalar = numba.njit(error_model='numpy')(namespace['scalar'])
+    output = 'float64' if kind == REAL else 'complex128'
+    ufunc = numba.vectorize([f"{output}(complex128, float64, float64)"], nopython=True)(
+        lambda z, X, Y: scalar(z, X, Y)
+    )
+    return ufunc
+
+
+KERNEL_FACTORIES = {'numexpr': _numexpr_kernel, 'numba': _numba_kernel}
+
+
+def _matches_numpy(kernel, reference):
+    z = PROBE_Z
+    with np.errstate(all='ignore'):
+        expected = np.asarray(reference(z, z.real, z.imag), dtype=complex)
+        actual = np.asarray(kernel(z, z.real, z.imag), dtype=complex)
+    expected, actual = np.broadcast_arrays(expected, actual)
+    return np.allclose(actual, expected, rtol=PROBE_RTOL, atol=PROBE_ATOL, equal_nan=True)
+
+
+@lru_cache(maxsize=256)
+def _select_kernel(key, backend):
+    reference = compile_function(key)
+    if backend == 'numpy' or reference.variables != FUNCTION_VARIABLES or reference.parameters:
+        return 'numpy', reference
+
+    candidates = AUTO_ORDER if backend == 'auto' else (backend,)
+    tree = ast.parse(key, mode='eval').body
+    for name in candidates:
+        if name not in available_backends():
+            continue
+        try:
+            kernel = KERNEL_FACTORIES[name](tree)
+            if _matches_numpy(kernel, reference):
+                logger.debug("Backend for %s: %s", key, name)
+                return name, kernel
+            logger.debug("Backend %s differs from numpy for %s", name, key)
+        except Unsupported as e:
+            logger.debug("Backend %s cannot evaluate %s (%s)", name, key, e)
+        except Exception as e:
+            logger.debug("Backend %s failed to compile %s: %s", name, key, e)
+
+    # gamma, factorial, comparisons, np.* calls and anything else not translated
+    return 'numpy', reference
+
+
+def select_kernel(function, backend=DEFAULT_BACKEND):
+    # (backend name, kernel(z, X, Y)) for a compiled function; cached per expression
+    return _select_kernel(function.key, backend)
+
+
+def evaluate_kernel(function, z_value, backend=DEFAULT_BACKEND):
+    name, kernel = select_kernel(function, backend)
+    if name == 'numpy':
+        return function(z_value, z_value.real, z_value.imag)
+    try:
+        return kernel(z_value, z_value.real, z_value.imag)
+    except ArithmeticError as e:
+        # e.g. numba raising on 0j ** -1 where numpy returns inf/nan
+        logger.debug("Backend %s raised %s for %s, using numpy", name, e, function.source)
+        return function(z_value, z_value.real, z_value.imag)
@@ -0,0 +1,264 @@
+# Headless batch rendering: no Qt, no display.
+#
+#   python batch.py items.jsonl --out-dir plots --format html,npz --workers 4
+#   echo '{"name": "gamma", "functions": ["gamma(z)"], "resolution": 400}' | python batch.py - --format json
+#
+# Each input line is either a JSON object with make_settings arguments (plus an optional
+# "name"), or a bare expression rendered with the default settings. A line that is neither is
+# reported as a failed item and the run carries on. Items are processed as
+# a stream by a process pool with a bounded number in flight, so memory stays flat however
+# long the input is. One JSON summary line per item is written to stdout, with the time
+# spent in each stage; logging goes to stderr (--log-level). With --cache-dir, evaluated
+# surfaces are kept on disk and reused by later runs and by the app (see cache.DiskStore).
+import argparse
+import contextlib
+import inspect
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from cache import DEFAULT_STORE_BYTES, DiskStore, SurfaceCache
+from plotting import DEFAULT_RANGES, VIEW_NAMES, build_figures, evaluate_settings, make_settings, surface_values
+from tracing import configure_logging, span, tracer
+from transport import figure_to_json
+
+OUTPUT_FORMATS = ('html', 'json', 'npz')
+
+# Keys of an input item that are not make_settings arguments
+ITEM_KEYS = ('name',)
+
+# make_settings arguments an item may set; anything else is most likely a typo
+SETTINGS_KEYS = tuple(name for name in inspect.signature(make_settings).parameters if name != 'ranges') + tuple(DEFAULT_RANGES)
+
+# Disk stores opened by this worker process, by directory
+_stores = {}
+
+
+def parse_item(line, number):
+    # The item of one input line, None for blank and comment lines; raises ValueError for
+    # lines that are not a valid item
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}") from None
+        if not isinstance(item, dict):
+            raise ValueError("An item must be a JSON object")
+    else:
+        item = dict(functions=[line])
+    item.setdefault('name', f"plot-{number:05d}")
+    # Names become file names in the output directory, and may not point out of it
+    name = item['name']
+    if not isinstance(name, str) or not name or '..' in name or any(char in name for char in '/\\:'):
+        raise ValueError(f"Invalid name {name!r}: names may not be empty or contain '..', '/', '\\' or ':'")
+    if isinstance(item.get('functions'), str):
+        item['functions'] = [item['functions']]
+
+    unknown = set(item) - set(ITEM_KEYS) - set(SETTINGS_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    return item
+
+
+def read_items(stream):
+    # Invalid lines become items with an "error", reported as failed without being rendered
+    number = 0
+    for line in stream:
+        try:
+            item = parse_item(line, number + 1)
+        except ValueError as e:
+            item = dict(name=f"plot-{number + 1:05d}", error=str(e))
+        if item is not None:
+            number += 1
+            yield item
+
+
+def page_html(figures, include_plotlyjs):
+    # The four plots in a 2x2 grid, like the application window
+    parts = []
+    for index, name in enumerate(VIEW_NAMES):
+        parts.append(figures[name].to_html(
+            full_html=False,
+            include_plotlyjs=include_plotlyjs if index == 0 else False,
+            default_height='48vh'
+        ))
+
+    cells = "\n".join(f'<div style="width: 50%; float: left;">{part}</div>' for part in parts)
+    return f"""<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"></head>
+<body style="margin: 0; background: #121212;">
+{cells}
+</body>
+</html>
+"""
+
+
+def write_npz(path, evaluated):
+    arrays = dict(x=evaluated['x'], y=evaluated['y'], real_z=evaluated['real_z'])
+    for index, surface in enumerate(evaluated['surfaces']):
+        arrays[f"f{index}_F"] = surface_values(surface)
+        for key in ('F_real', 'x', 'y', 'i', 'j', 'k'):
+            if key in surface:
+                arrays[f"f{index}_{key}"] = surface[key]
+    np.savez(path, **arrays)
+
+
+def get_store(cache_dir):
+    if cache_dir is None:
+        return None
+    if cache_dir not in _stores:
+        _stores[cache_dir] = DiskStore(cache_dir, DEFAULT_STORE_BYTES)
+    return _stores[cache_dir]
+
+
+def render_item(item, out_dir, formats, include_plotlyjs, cache_dir=None):
+    # Runs in a worker process; only the summary goes back to the parent
+    start = time.perf_counter()
+    name = item['name']
+    try:
+        # stdout carries the summary lines, diagnostics go to stderr
+        with contextlib.redirect_stdout(sys.stderr), tracer.collect() as timings:
+            files = render_outputs(item, out_dir, formats, include_plotlyjs, cache_dir)
+        timings = {stage: round(ms, 2) for stage, ms in timings.items()}
+        return dict(name=name, ok=True, files=files, seconds=round(time.perf_counter() - start, 3), timings=timings)
+
+    except Exception as e:
+        return dict(name=name, ok=False, error=str(e), seconds=round(time.perf_counter() - start, 3))
+
+
+def render_outputs(item, out_dir, formats, include_plotlyjs, cache_dir=None):
+    name = item['name']
+    options = {key: value for key, value in item.items() if key not in ITEM_KEYS}
+    options['workers'] = 1
+    # Full resolution grids of tiled items are kept next to the other outputs
+    options.setdefault('tile_dir', os.path.join(out_dir, 'tiles'))
+    settings = make_settings(**options)
+
+    # Nothing is reused between items, so the surface cache would only hold memory;
+    # surfaces from the disk store are memory-mapped instead
+    store = get_store(cache_dir)
+    evaluated = evaluate_settings(settings, cache=SurfaceCache(budget_bytes=0, store=store))
+    if store is not None:
+        # Stored before the item is reported done
+        store.flush()
+
+    files = list(evaluated.get('files', []))
+    if 'npz' in formats:
+        path = os.path.join(out_dir, f"{name}.npz")
+        write_npz(path, evaluated)
+        files.append(path)
+
+    if 'html' in formats or 'json' in formats:
+        with span('build_figures', resolution=settings['resolution']):
+            figures = build_figures(settings, evaluated=evaluated)
+
+        if 'json' in formats:
+            path = os.path.join(out_dir, f"{name}.json")
+            with span('serialize', format='json'), open(path, 'w', encoding='utf-8') as f:
+                f.write('{"name":' + json.dumps(name) + ',"figures":{')
+                f.write(','.join(f'"{view}":{figure_to_json(figures[view])}' for view in VIEW_NAMES))
+                f.write('}}')
+            files.append(path)
+
+        if 'html' in formats:
+            path = os.path.join(out_dir, f"{name}.html")
+            with span('serialize', format='html'), open(path, 'w', encoding='utf-8') as f:
+                f.write(page_html(figures, include_plotlyjs))
+            files.append(path)
+
+    return files
+
+
+def run_batch(items, out_dir, formats, workers, max_pending, include_plotlyjs, output=sys.stdout, log_level=None,
+              cache_dir=None):
+    os.makedirs(out_dir, exist_ok=True)
+
+    failures = 0
+    context = multiprocessing.get_context('spawn')
+    # Spawned workers start with an unconfigured logging module
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=configure_logging, initargs=(log_level,)) as executor:
+        pending = set()
+        for item in items:
+            if 'error' in item:
+                failures += 1
+                output.write(json.dumps(dict(name=item['name'], ok=False, error=item['error'], seconds=0.0)) + "\n")
+                output.flush()
+                continue
+            # Only a bounded number of items is in flight, the rest of the input is not read yet
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                failures += report(done, output)
+            pending.add(executor.submit(render_item, item, out_dir, formats, include_plotlyjs, cache_dir))
+
+        done, _ = wait(pending)
+        failures += report(done, output)
+
+    return failures
+
+
+def report(done, output):
+    failures = 0
+    for future in done:
+        result = future.result()
+        failures += not result['ok']
+        output.write(json.dumps(result) + "\n")
+    output.flush()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render complex function plots without a display.")
+    parser.add_argument('input', nargs='?', default='-', help="file with one item per line, or - for stdin")
+    parser.add_argument('--out-dir', default='plots')
+    parser.add_argument('--format', default='html', help="comma separated list of " + ", ".join(OUTPUT_FORMATS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-pending', type=int, default=None, help="items in flight (default: 2 per worker)")
+    parser.add_argument('--plotlyjs', default='directory', choices=('inline', 'directory', 'cdn'),
+                        help="how HTML output gets plotly.js (directory writes plotly.min.js once next to the pages)")
+    parser.add_argument('--log-level', default=None, choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help="logging written to stderr (default: COMPLEX_PLOT_LOG_LEVEL or WARNING)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="keep evaluated surfaces in this directory and reuse them across runs")
+    args = parser.parse_args(argv)
+    log_level = configure_logging(args.log_level)
+
+    formats = {fmt.strip() for fmt in args.format.split(',') if fmt.strip()}
+    unknown = formats - set(OUTPUT_FORMATS)
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(sorted(unknown))}")
+
+    include_plotlyjs = {'inline': True, 'directory': 'directory', 'cdn': 'cdn'}[args.plotlyjs]
+    if 'html' in formats and include_plotlyjs == 'directory':
+        # Written once here, instead of by every worker
+        from plotly.offline import get_plotlyjs
+
+        os.makedirs(args.out_dir, exist_ok=True)
+        with open(os.path.join(args.out_dir, 'plotly.min.js'), 'w', encoding='utf-8') as f:
+            f.write(get_plotlyjs())
+        include_plotlyjs = 'plotly.min.js'
+
+    max_pending = args.max_pending or 2 * max(args.workers, 1)
+
+    stream = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    try:
+        failures = run_batch(read_items(stream), args.out_dir, formats, args.workers, max_pending, include_plotlyjs,
+                             log_level=log_level, cache_dir=args.cache_dir)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# Evaluation time of each backend on a full grid, checked against the numpy result.
+# Expressions a backend cannot handle show which engine 'auto' fell back to.
+#
+#   python benchmarks/bench_backends.py [resolution]
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import available_backends, select_kernel
+from expression import compile_function, evaluate_function
+
+EXPRESSIONS = [
+    "z**2 + i",
+    "exp(z) * sin(z)",
+    "log(z**3 - 1) / (z + 2i)",
+    "cot(z) + arccot(z) - sqrt(z)",
+    "(z**5 - 3*z**3 + z - 1) / (z**4 + z**2 + 1) * exp(-abs(z))",
+    "sqrt(X) + angle(z) * Y",
+    "gamma(z)",
+]
+
+REPEATS = 5
+
+
+def time_evaluate(function, Z, backend):
+    evaluate_function(function, Z, backend)  # compile and warm up
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = evaluate_function(function, Z, backend)
+    return (time.perf_counter() - start) / REPEATS, result
+
+
+def main():
+    resolution = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    x = np.linspace(-3, 3, resolution)
+    X, Y = np.meshgrid(x, x)
+    Z = X + 1j * Y
+
+    backends = available_backends()
+    print(f"{resolution}x{resolution} grid, backends: {', '.join(backends)}")
+    print(f"{'expression':<60}" + "".join(f"{name:>14}" for name in backends) + "  auto uses")
+
+    failures = 0
+    for text in EXPRESSIONS:
+        function = compile_function(text)
+        with np.errstate(all='ignore'):
+            _, expected = time_evaluate(function, Z, 'numpy')
+            cells = []
+            for backend in backends:
+                seconds, result = time_evaluate(function, Z, backend)
+                ok = np.allclose(result, expected, rtol=1e-9, atol=1e-12, equal_nan=True)
+                failures += not ok
+                cells.append(f"{seconds * 1e3:>10.1f}ms{' ' if ok else '!'} ")
+        print(f"{text:<60}" + "".join(f"{cell:>14}" for cell in cells) + f"  {select_kernel(function, 'auto')[0]}")
+
+    print("! = differs from numpy" if failures else "All results match numpy")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
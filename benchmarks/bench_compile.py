@@ -0,0 +1,52 @@
+# Timings for the expression compiler: the parse/validate/compile cost is paid once
+# per distinct expression, later lookups only hit the LRU cache.
+#
+#   python benchmarks/bench_compile.py
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expression import compile_expression, compile_function, evaluate_function
+
+EXPRESSIONS = [
+    "z**2 + i",
+    "exp(z) * sin(z)",
+    "gamma(z)",
+    "log(z**3 - 1) / (z + 2i)",
+    "cot(z) + arccot(z) - sqrt(z)",
+]
+
+REPEATS = 1000
+
+
+def time_call(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    compile_expression.cache_clear()
+    z = np.linspace(-2, 2, 200) + 1j * np.linspace(-2, 2, 200)[:, None]
+
+    print(f"{'expression':<32}{'first compile':>16}{'cached lookup':>16}{'evaluate 200x200':>18}")
+    for text in EXPRESSIONS:
+        start = time.perf_counter()
+        function = compile_function(text)
+        first = time.perf_counter() - start
+
+        cached = time_call(lambda: compile_function(text), REPEATS)
+        evaluate = time_call(lambda: evaluate_function(function, z), 10)
+
+        print(f"{text:<32}{first * 1e6:>14.1f}us{cached * 1e6:>14.2f}us{evaluate * 1e3:>16.2f}ms")
+
+    print(compile_expression.cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Time and peak memory of the derive stage: the separate numpy calls it used to make
+# (abs, angle / pi, and contiguous real/imag copies for the float32 transport) against
+# derive_surface in double and single precision.
+#
+#   python benchmarks/bench_derive.py [resolution ...]
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plotting import FIELDS, derive_surface
+
+REPEATS = 5
+
+
+def separate(F, F_real):
+    # The previous derive stage plus the real/imag copies build_figures made from F
+    return dict(
+        F=F,
+        F_real=F_real,
+        magnitude=np.abs(F),
+        phase=np.angle(F) / np.pi,
+        real=np.ascontiguousarray(F.real, dtype=np.float32),
+        imag=np.ascontiguousarray(F.imag, dtype=np.float32)
+    )
+
+
+def measure(function):
+    function()
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        function()
+    seconds = (time.perf_counter() - start) / REPEATS
+
+    tracemalloc.start()
+    result = function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # What stays in the surface cache; F counts only where it is kept alongside the fields
+    kept = sum(array.nbytes for array in result.values())
+    return seconds, peak, kept, result
+
+
+def main():
+    resolutions = [int(value) for value in sys.argv[1:]] or [500, 1000, 2000]
+
+    print(f"{'resolution':>10}{'path':>12}{'ms':>10}{'peak MB':>10}{'kept MB':>10}")
+    for resolution in resolutions:
+        x = np.linspace(-2, 2, resolution)
+        with np.errstate(all='ignore'):
+            F = np.log(x + 1j * x[:, None]) / (x + 1j * x[:, None] - 1)
+        F_real = F[resolution // 2]
+
+        paths = dict(
+            separate=lambda: separate(F, F_real),
+            double=lambda: derive_surface(F, F_real, 'double'),
+            single=lambda: derive_surface(F, F_real, 'single'),
+        )
+        results = {}
+        for name, function in paths.items():
+            seconds, peak, kept, results[name] = measure(function)
+            # F itself is produced by evaluation and shared, it is not part of the peak
+            print(f"{resolution:>10}{name:>12}{seconds * 1e3:>10.1f}{peak / 1e6:>10.1f}{kept / 1e6:>10.1f}")
+
+        expected = dict(results['separate'], real=F.real, imag=F.imag)
+        for name in ('double', 'single'):
+            tolerance = 1e-6 if name == 'single' else 1e-12
+            for field in FIELDS:
+                assert np.allclose(results[name][field], expected[field], rtol=tolerance, atol=tolerance,
+                                   equal_nan=True), (name, field)
+
+
+if __name__ == "__main__":
+    main()
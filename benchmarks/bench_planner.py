@@ -0,0 +1,64 @@
+# Evaluation time of sets of functions that share subexpressions: each function on its own
+# against one shared plan, with the array operations the plan saves. Results of both the plan
+# and 'auto' are checked against the separate evaluation, so the sets double as regression
+# cases for the planner.
+#
+#   python benchmarks/bench_planner.py [resolution]
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expression import compile_function, evaluate_function
+from planner import evaluate_all, plan_report
+
+FUNCTION_SETS = [
+    ["exp(z**2)", "z**2 + 1", "sin(z**2)"],
+    ["sin(z) / z", "cos(z) / z", "sin(z) * cos(z)"],
+    ["log(z**3 - 1)", "1 / (z**3 - 1)", "sqrt(z**3 - 1) * exp(-abs(z))"],
+    ["sin(z)", "exp(z)", "z**2"],
+    # Repeated operands of one node, within a function and across functions
+    ["z * z", "X"],
+    ["sin(z) * sin(z) + gamma(z)", "gamma(z)"],
+]
+
+REPEATS = 5
+
+
+def measure(function):
+    function()
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = function()
+    return (time.perf_counter() - start) / REPEATS, result
+
+
+def main():
+    resolution = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    x = np.linspace(-2, 2, resolution)
+    Z = x + 1j * x[:, None]
+
+    print(f"{resolution}x{resolution} grid")
+    print(f"{'functions':<64}{'ops':>10}{'saved':>7}" + "".join(f"{name:>16}" for name in ('separate', 'plan', 'auto')))
+    for texts in FUNCTION_SETS:
+        functions = [compile_function(text) for text in texts]
+        report = plan_report(functions, 'numpy')
+        with np.errstate(all='ignore'):
+            separate, expected = measure(lambda: [evaluate_function(function, Z) for function in functions])
+            planned, results = measure(lambda: evaluate_all(functions, Z, 'numpy'))
+            # 'auto' plans only the functions that share something, the rest keep their fused kernels
+            auto, auto_results = measure(lambda: evaluate_all(functions, Z, 'auto'))
+        for result, auto_result, reference in zip(results, auto_results, expected):
+            assert np.allclose(result, reference, equal_nan=True), texts
+            assert np.allclose(auto_result, reference, equal_nan=True), texts
+
+        ops = f"{report['planned_ops']}/{report['separate_ops']}"
+        print(f"{', '.join(texts):<64}{ops:>10}{report['saved_ops']:>7}"
+              + "".join(f"{seconds * 1e3:>14.1f}ms" for seconds in (separate, planned, auto)))
+
+
+if __name__ == "__main__":
+    main()
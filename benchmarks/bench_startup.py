@@ -0,0 +1,136 @@
+# Startup benchmark: import time breakdown (python -X importtime) and time to first frame.
+#
+#   python benchmarks/bench_startup.py [--top 15] [--max-import-ms 400] [--max-first-frame-ms 1500]
+#
+# Each measurement runs in a fresh interpreter. Time to first frame is measured from just
+# before the interpreter is launched until the main window paints for the first time, and
+# time to first plot until the first render result reaches the window. With a threshold
+# given, the exit status is 1 when it is exceeded, so regressions can be caught in CI.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    # Returns (cumulative microseconds, name) for every module imported by `import module`
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.rstrip()))
+    return times
+
+
+def run_child(timeout):
+    # Runs inside the fresh interpreter started by first_frame_times
+    t0 = float(os.environ['STARTUP_T0'])
+    timings = {}
+
+    sys.path.insert(0, ROOT)
+    import main
+    from PyQt5.QtCore import QEvent, QObject, QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    timings['import_main'] = time.time() - t0
+
+    class FirstPaint(QObject):
+        def eventFilter(self, watched, event):
+            if event.type() == QEvent.Paint and 'first_frame' not in timings:
+                timings['first_frame'] = time.time() - t0
+            return False
+
+    main.register_plot_scheme()
+    app = QApplication(sys.argv[:1])
+    main.set_dark_mode(app)
+    window = main.PlotlyApp()
+    timings['window_created'] = time.time() - t0
+
+    paint_filter = FirstPaint()
+    window.installEventFilter(paint_filter)
+
+    def on_result(result):
+        if 'first_plot' not in timings:
+            timings['first_plot'] = time.time() - t0
+            QTimer.singleShot(0, app.quit)
+
+    window.render_pipeline.result_ready.connect(on_result)
+    QTimer.singleShot(int(timeout * 1000), app.quit)
+
+    window.showMaximized()
+    app.exec_()
+    window.close()
+
+    print(json.dumps({key: round(value * 1000, 1) for key, value in timings.items()}))
+
+
+def first_frame_times(timeout):
+    env = dict(os.environ, STARTUP_T0=repr(time.time()))
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', '--timeout', str(timeout)],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError((result.stderr.strip().splitlines() or ['child failed'])[-1])
+    return json.loads(lines[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--max-import-ms', type=float, default=None)
+    parser.add_argument('--max-first-frame-ms', type=float, default=None)
+    parser.add_argument('--no-gui', action='store_true', help="only measure import times")
+    parser.add_argument('--json', default=None, help="also write the results to this file")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.timeout)
+        return 0
+
+    times = import_times(args.module)
+    total_ms = next(cumulative for cumulative, name in times if name.strip() == args.module) / 1000
+    results = dict(import_ms=total_ms, imports=[])
+
+    print(f"import {args.module}: {total_ms:.1f} ms")
+    print(f"{'cumulative':>12}  module")
+    for cumulative, name in sorted(times, reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:>10.1f}ms  {name}")
+        results['imports'].append(dict(module=name.strip(), cumulative_ms=cumulative / 1000))
+
+    failed = args.max_import_ms is not None and total_ms > args.max_import_ms
+
+    if not args.no_gui:
+        frame = first_frame_times(args.timeout)
+        results.update(frame)
+        for key in ('import_main', 'window_created', 'first_frame', 'first_plot'):
+            if key in frame:
+                print(f"{key:>16}: {frame[key]:.1f} ms")
+        if args.max_first_frame_ms is not None:
+            failed = failed or frame.get('first_frame', float('inf')) > args.max_first_frame_ms
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
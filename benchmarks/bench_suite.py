@@ -0,0 +1,183 @@
+# Benchmark suite for the evaluation, figure building and serialization stages.
+# Runs headless (no Qt) and stores the results as JSON for comparison between commits.
+#
+#   python benchmarks/bench_suite.py --output bench-abc123.json
+#   python benchmarks/bench_suite.py --resolutions 100,200 --compare bench-abc123.json
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cache import SurfaceCache
+from expression import compile_function, compile_z_function, evaluate_function, evaluate_z
+from plotting import VIEW_NAMES, build_figures, derive_surface, evaluate_settings, make_settings
+from transport import figure_to_json
+
+# Representative expressions, from cheap to expensive
+CATALOGUE = {
+    'polynomial': "z**3 - 2*z + 1",
+    'rational': "(z**2 + 1) / (z**2 - 1)",
+    'exp': "exp(z)",
+    'log': "log(z)",
+    'gamma': "gamma(z)",
+    'nested_trig': "sin(cos(tan(z)))",
+}
+
+DEFAULT_RESOLUTIONS = (100, 200, 500, 1000, 2000)
+
+# Figure building and serialization are measured for this function only
+FIGURE_FUNCTION = 'exp'
+
+
+def measure(function, repeat):
+    # Returns the median wall time over `repeat` runs and the last return value
+    times = []
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), value
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+
+    import plotly
+    import scipy
+
+    return dict(
+        commit=commit,
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        scipy=scipy.__version__,
+        plotly=plotly.__version__,
+        machine=platform.machine(),
+        processor=platform.processor(),
+        cpus=os.cpu_count()
+    )
+
+
+def run_resolution(resolution, repeat, functions):
+    results = []
+
+    def record(stage, seconds, function=None, size=None):
+        entry = dict(stage=stage, resolution=resolution, seconds=seconds)
+        if function is not None:
+            entry['function'] = function
+        if size is not None:
+            entry['bytes'] = size
+        results.append(entry)
+        label = f"{stage}[{function}]" if function else stage
+        extra = f"  {size / 1e6:8.2f} MB" if size is not None else ""
+        print(f"{resolution:>6} {label:<34}{seconds * 1000:>10.2f} ms{extra}")
+
+    z_function = compile_z_function("")
+    x = np.linspace(-2, 2, resolution)
+    y = np.linspace(-2, 2, resolution)
+
+    seconds, (X, Y) = measure(lambda: np.meshgrid(x, y), repeat)
+    record('meshgrid', seconds)
+
+    seconds, Z = measure(lambda: evaluate_z(z_function, X, Y), repeat)
+    record('z_mapping', seconds)
+
+    for name in functions:
+        function = compile_function(CATALOGUE[name])
+        with np.errstate(all='ignore'):
+            seconds, F = measure(lambda: evaluate_function(function, Z), repeat)
+            record('evaluate', seconds, name)
+
+            seconds, _ = measure(lambda: derive_surface(F, F[0]), repeat)
+            record('derive', seconds, name)
+
+    # Figure building and serialization of the four plots for one function
+    settings = make_settings(functions=[CATALOGUE[FIGURE_FUNCTION]], resolution=resolution, workers=1)
+    evaluated = evaluate_settings(settings, cache=SurfaceCache(budget_bytes=0))
+
+    seconds, figures = measure(lambda: build_figures(settings, evaluated=evaluated), repeat)
+    record('build_figures', seconds, FIGURE_FUNCTION)
+
+    seconds, payloads = measure(lambda: [figure_to_json(figures[view]) for view in VIEW_NAMES], repeat)
+    record('serialize_transport', seconds, FIGURE_FUNCTION, sum(len(payload) for payload in payloads))
+
+    seconds, payloads = measure(lambda: [figures[view].to_json() for view in VIEW_NAMES], repeat)
+    record('serialize_plotly_json', seconds, FIGURE_FUNCTION, sum(len(payload) for payload in payloads))
+
+    # plotly.js itself is left out, it is the same few megabytes for every figure
+    seconds, pages = measure(lambda: [figures[view].to_html(include_plotlyjs=False) for view in VIEW_NAMES], repeat)
+    record('serialize_html', seconds, FIGURE_FUNCTION, sum(len(page) for page in pages))
+
+    return results
+
+
+def result_key(entry):
+    return (entry['stage'], entry.get('function', ''), entry['resolution'])
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {result_key(entry): entry for entry in baseline['results']}
+
+    print(f"\nComparison with {baseline_path} (commit {baseline['meta'].get('commit', '')[:10]})")
+    print(f"{'stage':<34}{'res':>6}{'before':>12}{'after':>12}{'ratio':>8}")
+    for entry in results:
+        old = previous.get(result_key(entry))
+        if old is None:
+            continue
+        label = f"{entry['stage']}[{entry['function']}]" if 'function' in entry else entry['stage']
+        ratio = entry['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+        print(f"{label:<34}{entry['resolution']:>6}{old['seconds'] * 1000:>10.2f}ms{entry['seconds'] * 1000:>10.2f}ms{ratio:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resolutions', default=','.join(str(size) for size in DEFAULT_RESOLUTIONS))
+    parser.add_argument('--functions', default=','.join(CATALOGUE), help="names from the catalogue")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help="write the results to this JSON file")
+    parser.add_argument('--compare', default=None, help="JSON file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    resolutions = [int(size) for size in args.resolutions.split(',')]
+    functions = [name.strip() for name in args.functions.split(',')]
+    unknown = [name for name in functions if name not in CATALOGUE]
+    if unknown:
+        parser.error(f"unknown function(s): {', '.join(unknown)}")
+
+    # Pay imports and first-call costs before measuring
+    run_resolution(10, 1, functions)
+    print()
+
+    results = []
+    for resolution in resolutions:
+        results.extend(run_resolution(resolution, args.repeat, functions))
+
+    report = dict(meta=metadata(), results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+# Peak memory and time of uniform against tiled evaluation of the same grid.
+# numpy reports its allocations to tracemalloc, so the peak covers every array involved.
+#
+#   python benchmarks/bench_tiled.py [resolution ...]
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import SurfaceCache
+from plotting import evaluate_settings, make_settings
+
+FUNCTIONS = ["sin(z) / z", "log(z**3 - 1)"]
+
+
+def measure(settings):
+    tracemalloc.start()
+    start = time.perf_counter()
+    evaluated = evaluate_settings(settings, cache=SurfaceCache(budget_bytes=0))
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, evaluated
+
+
+def main():
+    resolutions = [int(value) for value in sys.argv[1:]] or [1000, 2000, 4000]
+
+    with tempfile.TemporaryDirectory() as tile_dir:
+        print(f"{'resolution':>10}{'mode':>10}{'seconds':>10}{'peak MB':>10}{'plotted':>10}")
+        for resolution in resolutions:
+            base = dict(functions=FUNCTIONS, workers=1, backend='numpy', resolution=resolution, tile_dir=tile_dir)
+            for sampling in ('uniform', 'tiled'):
+                seconds, peak, evaluated = measure(make_settings(sampling=sampling, **base))
+                size = len(evaluated['x'])
+                print(f"{resolution:>10}{sampling:>10}{seconds:>10.2f}{peak / 1e6:>10.1f}{f'{size}x{size}':>10}")
+
+            # The files hold the full grid, identical to the uniform result
+            grid = np.load(evaluated['files'][0], mmap_mode='r')
+            print(f"{'':>10}{'file':>10}{os.path.getsize(evaluated['files'][0]) / 1e6:>19.1f} MB on disk, shape {grid.shape}")
+            del grid
+
+
+if __name__ == "__main__":
+    main()
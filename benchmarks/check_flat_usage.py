@@ -0,0 +1,87 @@
+# Check that memory and disk usage stay flat over many consecutive updates.
+# Runs the same path as the app (render, then hand the payload to the in-memory asset
+# store) without a display, and fails if RSS or the temp directory keep growing.
+#
+#   python benchmarks/check_flat_usage.py [--updates 1000]
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assets import AssetStore, data_path, install_static_assets
+from cache import grid_cache, surface_cache
+from plotting import VIEW_NAMES, make_settings, render_plots
+
+EXPRESSIONS = ["z**2 + i", "exp(z) * sin(z)", "gamma(z)", "log(z**3 - 1)", "cot(z)"]
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def disk_usage(path):
+    count = size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+                count += 1
+            except OSError:
+                pass
+    return count, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--tolerance-mb', type=float, default=32)
+    args = parser.parse_args()
+
+    # Keep the surface and z grid caches small so they reach their budgets during warm-up
+    surface_cache.budget_bytes = 16 * 1024 * 1024
+    grid_cache.budget_bytes = 4 * 1024 * 1024
+
+    store = AssetStore()
+    install_static_assets(store)
+    temp_dir = tempfile.gettempdir()
+    disk_before = disk_usage(temp_dir)
+
+    for update in range(args.updates):
+        # Every update changes the domain slightly, so each one is evaluated from scratch
+        settings = make_settings(
+            functions=[EXPRESSIONS[update % len(EXPRESSIONS)]],
+            x_max=2 + update * 1e-3,
+            workers=1
+        )
+        payloads, _ = render_plots(settings)
+        for name in VIEW_NAMES:
+            store.put(data_path(name), 'application/json', payloads[name])
+
+        if update + 1 == args.warmup:
+            rss_warm = rss_bytes()
+            store_warm = store.total_bytes()
+
+    rss_end = rss_bytes()
+    disk_after = disk_usage(temp_dir)
+
+    rss_growth = (rss_end - rss_warm) / 1e6
+    print(f"RSS after warm-up: {rss_warm / 1e6:.1f} MB, after {args.updates} updates: {rss_end / 1e6:.1f} MB")
+    print(f"Asset store: {store_warm / 1e6:.1f} MB after warm-up, {store.total_bytes() / 1e6:.1f} MB at the end")
+    print(f"Temp dir: {disk_before[0]} files / {disk_before[1] / 1e6:.1f} MB before, "
+          f"{disk_after[0]} files / {disk_after[1] / 1e6:.1f} MB after")
+
+    flat = rss_growth <= args.tolerance_mb and disk_after[0] <= disk_before[0]
+    print("flat" if flat else "NOT flat")
+    return 0 if flat else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from importlib import metadata
+
+import numpy as np
+
+from expression import parameter_values
+
+logger = logging.getLogger(__name__)
+
+# Default memory budget for cached surfaces
+DEFAULT_BUDGET_BYTES = 256 * 1024 * 1024
+
+# Surfaces persisted across sessions live here (COMPLEX_PLOT_CACHE_DIR overrides it),
+# up to this many bytes on disk (COMPLEX_PLOT_CACHE_MB overrides it, 0 turns the store off)
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'complexplot')
+DEFAULT_STORE_BYTES = 2 * 1024 * 1024 * 1024
+
+# Bumped whenever the layout of stored surfaces changes, so old entries are never read
+STORE_FORMAT = 1
+
+# Libraries whose version can change the evaluated values
+VERSIONED_LIBRARIES = ('numpy', 'scipy', 'numexpr', 'numba')
+
+
+def surface_key(function, z_function, settings, dtype):
+    # Everything the numeric result depends on; cosmetic settings are left out on purpose
+    return (
+        function.key,
+        z_function.key,
+        float(settings['x_min']), float(settings['x_max']),
+        float(settings['y_min']), float(settings['y_max']),
+        int(settings['resolution']),
+        settings['backend'],
+        np.dtype(dtype).str,
+        parameter_values(function, settings['parameters']),
+        parameter_values(z_function, settings['parameters'])
+    )
+
+
+def grid_key(z_function, settings):
+    # The mapped z grid depends on the domain and the z mapping only, so it is shared by
+    # every function and by all values of the functions' parameters
+    return (
+        'grid',
+        z_function.key,
+        float(settings['x_min']), float(settings['x_max']),
+        float(settings['y_min']), float(settings['y_max']),
+        int(settings['resolution']),
+        parameter_values(z_function, settings['parameters'])
+    )
+
+
+def entry_bytes(entry):
+    return sum(array.nbytes for array in entry.values())
+
+
+def library_versions():
+    versions = []
+    for name in VERSIONED_LIBRARIES:
+        try:
+            versions.append((name, metadata.version(name)))
+        except metadata.PackageNotFoundError:
+            versions.append((name, None))
+    return tuple(versions)
+
+
+class DiskStore:
+    # Content-addressed store of surfaces on disk, shared by sessions and processes. An entry is a
+    # directory of .npy files named by a hash of its key and the library versions, read back
+    # memory-mapped. index.json records the size and last use of every entry for the LRU size cap;
+    # it can always be rebuilt from the directories. Writes happen on a background thread.
+
+    def __init__(self, directory=DEFAULT_STORE_DIR, budget_bytes=DEFAULT_STORE_BYTES):
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        self.versions = (STORE_FORMAT,) + library_versions()
+        self.lock = threading.Lock()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='store-writer')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.index = self.read_index()
+        # The budget may have been lowered since the last session
+        if self.evict():
+            self.write_index()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def digest(self, key):
+        return hashlib.sha256(repr((key, self.versions)).encode('utf-8')).hexdigest()
+
+    def read_index(self):
+        # Entries on disk with their size and last use; directories missing from the index
+        # (e.g. written by another process) are picked up with their modification time
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+        entries = {}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if len(name) != 64 or not os.path.isdir(path):
+                continue
+            entry = index.get(name)
+            if entry is None:
+                size = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+                entry = dict(bytes=size, used=os.path.getmtime(path))
+            entries[name] = entry
+        return entries
+
+    def write_index(self):
+        # Merged with the index on disk, so entries written by other processes are kept
+        on_disk = self.read_index()
+        for name, entry in on_disk.items():
+            if name in self.index:
+                entry['used'] = max(entry['used'], self.index[name]['used'])
+        self.index = on_disk
+
+        temporary = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(temporary, self.index_path)
+
+    def get(self, key):
+        name = self.digest(key)
+        path = os.path.join(self.directory, name)
+        try:
+            entry = {}
+            for file in os.listdir(path):
+                if file.endswith('.npy'):
+                    entry[file[:-4]] = load_array(os.path.join(path, file))
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Removing unreadable cache entry %s: %s", path, e)
+            shutil.rmtree(path, ignore_errors=True)
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+            self.index.setdefault(name, dict(bytes=entry_bytes(entry), used=0))['used'] = time.time()
+        return entry
+
+    def put(self, key, entry):
+        # Entries are read-only, so they can be written after the render has moved on
+        self.writer.submit(self.write, key, entry)
+
+    def write(self, key, entry):
+        name = self.digest(key)
+        path = os.path.join(self.directory, name)
+        try:
+            if not os.path.isdir(path):
+                # Written next to the final place and renamed, so readers never see half an entry
+                temporary = f"{path}.{os.getpid()}.tmp"
+                os.makedirs(temporary, exist_ok=True)
+                for field, array in entry.items():
+                    np.save(os.path.join(temporary, f"{field}.npy"), np.asarray(array))
+                try:
+                    os.rename(temporary, path)
+                except OSError:
+                    # Another process stored the same entry first
+                    shutil.rmtree(temporary, ignore_errors=True)
+
+            with self.lock:
+                self.index[name] = dict(bytes=entry_bytes(entry), used=time.time())
+                self.evict(keep=name)
+                self.write_index()
+        except OSError as e:
+            logger.warning("Could not store surface in %s: %s", self.directory, e)
+
+    def evict(self, keep=None):
+        # Drop the least recently used entries until the budget holds; returns how many went
+        evicted = 0
+        total = sum(entry['bytes'] for entry in self.index.values())
+        for name in sorted(self.index, key=lambda name: self.index[name]['used']):
+            if total <= self.budget_bytes:
+                break
+            if name == keep:
+                continue
+            total -= self.index.pop(name)['bytes']
+            # Memory maps of the files stay valid after removal on POSIX systems
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def flush(self):
+        # Wait for the writes submitted so far
+        self.writer.submit(lambda: None).result()
+
+    def close(self):
+        # Finish the writes and record the last uses of this session
+        self.flush()
+        with self.lock:
+            try:
+                self.write_index()
+            except OSError as e:
+                logger.warning("Could not update %s: %s", self.index_path, e)
+        self.writer.shutdown()
+
+    def clear(self):
+        self.flush()
+        with self.lock:
+            for name in list(self.index):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            self.index = {}
+            self.write_index()
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                entries=len(self.index),
+                bytes=sum(entry['bytes'] for entry in self.index.values()),
+                budget_bytes=self.budget_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions
+            )
+
+
+def load_array(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # Empty arrays cannot be memory-mapped
+        return np.load(path)
+
+
+def open_store(directory=None, budget_bytes=None):
+    # The store configured by the environment, or None if it is turned off
+    directory = directory or os.environ.get('COMPLEX_PLOT_CACHE_DIR') or DEFAULT_STORE_DIR
+    if budget_bytes is None:
+        megabytes = os.environ.get('COMPLEX_PLOT_CACHE_MB')
+        budget_bytes = int(float(megabytes) * 1024 * 1024) if megabytes else DEFAULT_STORE_BYTES
+    if budget_bytes <= 0:
+        return None
+    try:
+        return DiskStore(directory, budget_bytes)
+    except OSError as e:
+        logger.warning("Surface store in %s unavailable: %s", directory, e)
+        return None
+
+
+class SurfaceCache:
+    # LRU cache of evaluated surfaces, bounded by the total size of the cached arrays.
+    # With a store, misses are looked up on disk and new surfaces are persisted there too.
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES, store=None):
+        self.budget_bytes = budget_bytes
+        self.store = store
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self.load(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def peek(self, key):
+        # Look up an entry without counting it as a hit or miss
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+        return self.load(key)
+
+    def load(self, key):
+        # A surface stored by an earlier session, kept in memory from now on
+        if self.store is None:
+            return None
+        entry = self.store.get(key)
+        if entry is not None:
+            self.put(key, entry, persist=False)
+        return entry
+
+    def put(self, key, entry, persist=True):
+        # Cached arrays are shared between renders, so they are made read-only
+        for array in entry.values():
+            array.setflags(write=False)
+        if persist and self.store is not None:
+            self.store.put(key, entry)
+
+        size = entry_bytes(entry)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= entry_bytes(self.entries.pop(key))
+            if size > self.budget_bytes:
+                return entry
+
+            self.entries[key] = entry
+            self.total_bytes += size
+            while self.total_bytes > self.budget_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= entry_bytes(evicted)
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                entries=len(self.entries),
+                bytes=self.total_bytes,
+                budget_bytes=self.budget_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions
+            )
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Shared by every render in this process
+surface_cache = SurfaceCache()
+
+# Mapped z grids, kept while a parameter is swept or scrubbed; a 2000² grid is 64 MB
+grid_cache = SurfaceCache(budget_bytes=128 * 1024 * 1024)
@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+
+# Vertices of the surfaces sent per view, shared by its traces
+DEFAULT_VERTEX_BUDGET = 250_000
+
+
+def mask_range(values, low=-np.inf, high=np.inf):
+    # Copy of values with nan for the samples that are not finite or lie outside [low, high];
+    # the plots would clip them at the axis range anyway, or fail to draw them at all.
+    # Returns the copy and the mask of the samples that are kept.
+    with np.errstate(invalid='ignore'):
+        visible = np.isfinite(values) & (values >= low) & (values <= high)
+    masked = np.array(values, dtype=np.result_type(values, np.float32))
+    masked[~visible] = np.nan
+    return masked, visible
+
+
+def crop_bounds(visible):
+    # Row and column slices of the smallest box holding every visible sample; a grid with
+    # none keeps its first sample, so its trace stays a valid (empty) surface
+    rows = np.flatnonzero(visible.any(axis=1))
+    cols = np.flatnonzero(visible.any(axis=0))
+    if not len(rows):
+        return slice(0, 1), slice(0, 1)
+    return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+
+
+def decimation_indices(size, step):
+    # Every step-th index and the last one, so the surface keeps its edges
+    indices = np.arange(0, size, step)
+    if indices[-1] != size - 1:
+        indices = np.append(indices, size - 1)
+    return indices
+
+
+def clip_grid(values, phase, x, y, low, high, budget):
+    # A surface on the x/y grid as it is sent: masked to [low, high], cropped to its visible
+    # samples, and every step-th row and column kept so that about budget vertices remain.
+    # Returns (values, phase, x, y).
+    masked, visible = mask_range(values, low, high)
+    rows, cols = crop_bounds(visible)
+    masked, phase, x, y = masked[rows, cols], phase[rows, cols], x[cols], y[rows]
+
+    step = math.ceil(math.sqrt(masked.size / max(budget, 1)))
+    if step > 1:
+        row_indices = decimation_indices(len(y), step)
+        col_indices = decimation_indices(len(x), step)
+        grid = np.ix_(row_indices, col_indices)
+        masked, phase, x, y = masked[grid], phase[grid], x[col_indices], y[row_indices]
+    return masked, phase, x, y
+
+
+def clip_mesh(values, phase, x, y, i, j, k, low, high):
+    # An adaptive mesh as it is sent: the triangles with a vertex outside [low, high] are
+    # dropped, and so are the vertices no remaining triangle uses. Adaptive meshes are already
+    # sized by their point budget, so they are not decimated further.
+    # Returns (values, phase, x, y, i, j, k).
+    masked, visible = mask_range(values, low, high)
+    kept = visible[i] & visible[j] & visible[k]
+    i, j, k = i[kept], j[kept], k[kept]
+
+    used = np.zeros(len(values), dtype=bool)
+    used[np.concatenate((i, j, k))] = True
+    index = (np.cumsum(used) - 1).astype(i.dtype)
+    return masked[used], phase[used], x[used], y[used], index[i], index[j], index[k]
@@ -0,0 +1,93 @@
+import base64
+import struct
+import zlib
+
+import numpy as np
+
+# What the magnitude view shows: the 3-D surface, or a flat domain-colored image
+MAGNITUDE_VIEWS = ('surface', 'domain')
+
+# Lightness drops by up to this much between powers of two of |f|, drawing magnitude contours
+CONTOUR_DEPTH = 0.2
+
+# Fast compression is good enough here, the image is sent once per update
+PNG_COMPRESSION = 1
+
+# Pixels where f is nan
+NAN_COLOR = 128
+
+
+def domain_colors(magnitude, phase, contours=True):
+    # Hue from the phase of f (in π units), lightness from log|f| (zeros black, poles white),
+    # as uint8 RGB. HSL with full saturation is converted to RGB in one vectorized pass per channel.
+    # Everything runs in float32, which is plenty for 8-bit colors and about twice as fast
+    with np.errstate(all='ignore'):
+        # Phase in twelfths of a turn (-6..6), the unit of the conversion below
+        hue12 = np.asarray(phase, dtype=np.float32) * np.float32(6)
+        hue12[np.isnan(hue12)] = 0
+        log_magnitude = np.log(np.asarray(magnitude, dtype=np.float32))
+
+        lightness = np.arctan(0.5 * log_magnitude)
+        lightness *= np.float32(1 / np.pi)
+        lightness += np.float32(0.5)
+        if contours:
+            # Sawtooth of log2|f|; x - floor(x) is much faster than x % 1 for float32
+            band = log_magnitude * np.float32(1 / np.log(2))
+            band -= np.floor(band)
+            # Zeros and poles keep their black and white
+            band[np.isnan(band)] = 1
+            lightness *= np.float32(1 - CONTOUR_DEPTH) + np.float32(CONTOUR_DEPTH) * band
+        nan = np.isnan(lightness)
+
+        # HSL to RGB, see the CSS color module: f(n) = L - a * max(-1, min(k - 3, 9 - k, 1))
+        amplitude = np.minimum(lightness, 1 - lightness)
+        amplitude *= 255
+        lightness *= 255
+        lightness += np.float32(0.5)
+        rgb = np.empty(hue12.shape + (3,), dtype=np.uint8)
+        for channel, n in enumerate((0, 8, 4)):
+            k = hue12 + np.float32(n)
+            k -= 12 * np.floor(k * np.float32(1 / 12))
+            k = np.clip(np.minimum(k - 3, 9 - k), -1, 1)
+            k *= amplitude
+            rgb[..., channel] = lightness - k
+
+    rgb[nan] = NAN_COLOR
+    return rgb
+
+
+def png_bytes(rgb):
+    # Minimal truecolor PNG: every row uses the "up" filter, so smooth images compress well
+    height, width, _ = rgb.shape
+    filtered = np.empty((height, 1 + width * 3), dtype=np.uint8)
+    filtered[:, 0] = 2
+    rows = rgb.reshape(height, width * 3)
+    filtered[0, 1:] = rows[0]
+    np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', header)
+        + chunk(b'IDAT', zlib.compress(filtered.tobytes(), PNG_COMPRESSION))
+        + chunk(b'IEND', b'')
+    )
+
+
+def png_data_uri(rgb):
+    return 'data:image/png;base64,' + base64.b64encode(png_bytes(rgb)).decode('ascii')
+
+
+def domain_trace(magnitude, phase, x, y, contours=True):
+    # One image trace; row 0 is the lowest y, the figure keeps the y axis upright (see build_figures)
+    import plotly.graph_objects as go
+
+    return go.Image(
+        source=png_data_uri(domain_colors(magnitude, phase, contours)),
+        x0=float(x[0]), dx=float(x[1] - x[0]) if len(x) > 1 else 1.0,
+        y0=float(y[0]), dy=float(y[1] - y[0]) if len(y) > 1 else 1.0,
+        hoverinfo='x+y'
+    )
@@ -0,0 +1,256 @@
+import ast
+import io
+import tokenize
+from functools import lru_cache
+
+import numpy as np
+
+from tracing import span
+
+
+# scipy is imported on first use of these functions, it is slow to import at startup
+def gamma(x):
+    from scipy import special
+    return special.gamma(x)
+
+
+def factorial(x):
+    return gamma(x + 1)
+
+
+def cot(x):
+    return 1 / np.tan(x)
+
+
+def arccot(x):
+    return np.pi / 2 - np.arctan(x)
+
+
+# Mathematical functions that user expressions are allowed to call
+SAFE_FUNCTIONS = {
+    'np': np,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'cot': cot,
+    'sqrt': np.sqrt,
+    'log': np.log,
+    'exp': np.exp,
+    'abs': np.abs,
+    'arctan': np.arctan,
+    'arccot': arccot,
+    'arccos': np.arccos,
+    'arcsin': np.arcsin,
+    'angle': np.angle,
+    'vstack': np.vstack,
+    'hstack': np.hstack,
+    'dstack': np.dstack,
+    'column_stack': np.column_stack,
+    'transpose': np.transpose,
+    'gamma': gamma,
+    'factorial': factorial,
+    # Constants, so they are not taken for parameters
+    'pi': np.pi,
+    'e': np.e
+}
+
+# Variables available to the z mapping and to the plotted functions
+Z_VARIABLES = ('X', 'Y')
+FUNCTION_VARIABLES = ('z', 'X', 'Y')
+
+DEFAULT_Z_FUNCTION = "X + 1j * Y"
+
+# Lower case names the z mapping also accepts for its variables, so x + i*y is not read as
+# two parameters
+Z_ALIASES = {'x': 'X', 'y': 'Y'}
+
+# Any other free name (e.g. a in z**n + a) is a parameter, set by a slider in the UI
+DEFAULT_PARAMETER_VALUE = 1.0
+
+# Functions that combine or reorder samples instead of mapping each one on its own
+NON_ELEMENTWISE = {'vstack', 'hstack', 'dstack', 'column_stack', 'transpose', 'np'}
+
+# Attributes that may be read from any value (e.g. z.real)
+ALLOWED_ATTRIBUTES = {'real', 'imag', 'conjugate', 'T'}
+
+ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name,
+    ast.Load, ast.Constant, ast.Attribute, ast.Tuple, ast.List,
+    ast.operator, ast.unaryop, ast.cmpop
+)
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+def rewrite_imaginary_unit(text):
+    # Replace the name i with 1j at token level, so names like sin or pi are left alone
+    # and a number directly followed by i (e.g. 2i) becomes an imaginary literal
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(text).readline))
+    except (tokenize.TokenError, SyntaxError) as e:
+        raise ExpressionError(f"Invalid expression {text!r}: {e}") from None
+
+    rewritten = []
+    for token in tokens:
+        if token.type == tokenize.NAME and token.string == 'i':
+            previous = rewritten[-1] if rewritten else None
+            if (previous is not None and previous.type == tokenize.NUMBER
+                    and previous.end == token.start
+                    and not previous.string.lower().endswith('j')):
+                rewritten[-1] = previous._replace(string=previous.string + 'j', end=token.end)
+                continue
+            token = token._replace(string='1j')
+        rewritten.append(token)
+
+    return tokenize.untokenize(rewritten).strip()
+
+
+def rename_variables(text, aliases):
+    # Replace the names in aliases at token level, leaving attributes (e.g. np.y) alone
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(text).readline))
+    except (tokenize.TokenError, SyntaxError) as e:
+        raise ExpressionError(f"Invalid expression {text!r}: {e}") from None
+
+    renamed = []
+    for token in tokens:
+        previous = renamed[-1] if renamed else None
+        is_attribute = previous is not None and previous.type == tokenize.OP and previous.string == '.'
+        if token.type == tokenize.NAME and token.string in aliases and not is_attribute:
+            token = token._replace(string=aliases[token.string])
+        renamed.append(token)
+
+    return tokenize.untokenize(renamed).strip()
+
+
+def _validate(tree, variables, text):
+    # Returns the parameters of the expression: free names that are not called
+    allowed_names = set(SAFE_FUNCTIONS) | set(variables)
+    called = {node.func.id for node in ast.walk(tree) if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)}
+    parameters = set()
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ExpressionError(f"Unsupported syntax {type(node).__name__} in {text!r}")
+
+        if isinstance(node, ast.Name) and node.id not in allowed_names:
+            if node.id in called or node.id.startswith('_'):
+                raise ExpressionError(f"Unknown name {node.id!r} in {text!r}")
+            parameters.add(node.id)
+
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex)):
+            raise ExpressionError(f"Unsupported constant {node.value!r} in {text!r}")
+
+        if isinstance(node, ast.Attribute):
+            if node.attr.startswith('_'):
+                raise ExpressionError(f"Private attribute {node.attr!r} in {text!r}")
+            is_numpy = isinstance(node.value, ast.Name) and node.value.id == 'np'
+            if not is_numpy and node.attr not in ALLOWED_ATTRIBUTES:
+                raise ExpressionError(f"Unsupported attribute {node.attr!r} in {text!r}")
+            if is_numpy and not hasattr(np, node.attr):
+                raise ExpressionError(f"Unknown numpy attribute {node.attr!r} in {text!r}")
+
+    return tuple(sorted(parameters))
+
+
+class CompiledExpression:
+    # A validated expression compiled once into a plain Python function of its variables,
+    # followed by its parameters
+
+    __slots__ = ('source', 'key', 'variables', 'parameters', 'names', 'function', 'elementwise')
+
+    def __init__(self, source, key, variables, names, function, elementwise=False, parameters=()):
+        self.source = source
+        # Canonical form of the expression, identical for inputs that only differ in spacing
+        self.key = key
+        self.variables = variables
+        self.parameters = parameters
+        self.names = names
+        self.function = function
+        # Each output sample depends only on the input sample at the same position,
+        # so evaluating any subset of the inputs gives the same values
+        self.elementwise = elementwise
+
+    def __call__(self, *args):
+        return self.function(*args)
+
+    def depends_on(self, name):
+        return name in self.names
+
+    def __repr__(self):
+        return f"CompiledExpression({self.source!r})"
+
+
+@lru_cache(maxsize=256)
+def compile_expression(text, variables=FUNCTION_VARIABLES):
+    # Only runs on a cache miss, so the parse span shows up once per distinct expression
+    with span('parse', expression=text):
+        return _compile_expression(text, variables)
+
+
+def _compile_expression(text, variables):
+    source = rewrite_imaginary_unit(text)
+    if not source:
+        raise ExpressionError("Empty expression")
+
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError as e:
+        raise ExpressionError(f"Invalid expression {text!r}: {e.msg}") from None
+
+    parameters = _validate(tree, variables, text)
+
+    # Wrap the expression into "lambda <variables>, <parameters>: <expression>" and compile it once
+    lambda_node = ast.Lambda(
+        args=ast.arguments(
+            posonlyargs=[], args=[ast.arg(arg=name) for name in variables + parameters],
+            vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]
+        ),
+        body=tree.body
+    )
+    module = ast.fix_missing_locations(ast.Expression(body=lambda_node))
+    code = compile(module, f"<expression {source}>", 'eval')
+    function = eval(code, {'__builtins__': {}, **SAFE_FUNCTIONS})
+
+    names = frozenset(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+    transposed = any(isinstance(node, ast.Attribute) and node.attr == 'T' for node in ast.walk(tree))
+    elementwise = not transposed and not names & NON_ELEMENTWISE
+    return CompiledExpression(source, ast.unparse(tree), variables, names, function, elementwise, parameters)
+
+
+def compile_z_function(text):
+    return compile_expression(rename_variables(text.strip() or DEFAULT_Z_FUNCTION, Z_ALIASES), Z_VARIABLES)
+
+
+def compile_function(text):
+    return compile_expression(text.strip(), FUNCTION_VARIABLES)
+
+
+def parameter_values(expression, parameters=None):
+    # Values of the expression's parameters in its argument order; unset ones get the default
+    parameters = parameters or {}
+    return tuple(float(parameters.get(name, DEFAULT_PARAMETER_VALUE)) for name in expression.parameters)
+
+
+def evaluate_z(z_function, X, Y, parameters=None):
+    # Map the sample grid (X, Y) to complex z values through the z mapping
+    z_value = np.asarray(z_function(X, Y, *parameter_values(z_function, parameters)))
+    if z_value.shape != np.shape(X):
+        z_value = np.broadcast_to(z_value, np.shape(X))
+    return z_value.astype(complex, copy=False)
+
+
+def evaluate_function(function, z_value, backend='numpy', parameters=None):
+    # Evaluate a compiled function on already mapped z values, broadcasting constants to the grid.
+    # Other backends run it through a numexpr or numba kernel when they can (see backends.py).
+    if backend == 'numpy' or function.parameters:
+        values = parameter_values(function, parameters)
+        result = np.asarray(function(z_value, z_value.real, z_value.imag, *values))
+    else:
+        from backends import evaluate_kernel
+        result = np.asarray(evaluate_kernel(function, z_value, backend))
+    if result.shape != z_value.shape:
+        result = np.zeros_like(z_value) + result
+    return result
@@ -1,11 +1,33 @@
-import sys, re
-import numpy as np
-import plotly.graph_objects as go
-from PyQt5.QtWidgets import QApplication, QVBoxLayout, QMainWindow, QWidget, QLineEdit, QPushButton, QHBoxLayout, QGridLayout, QLabel, QSpacerItem, QSizePolicy, QSplitter, QScrollArea, QCheckBox, QButtonGroup, QComboBox
-from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtCore import Qt, QUrl
-import tempfile
-from scipy import special
+import logging
+import sys
+from PyQt5.QtWidgets import QApplication, QVBoxLayout, QMainWindow, QWidget, QLineEdit, QPushButton, QHBoxLayout, QGridLayout, QLabel, QSpacerItem, QSizePolicy, QSplitter, QScrollArea, QCheckBox, QButtonGroup, QComboBox, QProgressBar, QSpinBox, QFileDialog
+from PyQt5.QtCore import Qt, QTimer
+from adaptive import DEFAULT_POINT_BUDGET
+from cache import open_store, surface_cache
+from clipping import DEFAULT_VERTEX_BUDGET
+from backends import DEFAULT_BACKEND, available_backends
+from domain import MAGNITUDE_VIEWS
+from expression import ExpressionError, compile_function, compile_z_function
+from tiled import DEFAULT_DISPLAY_RESOLUTION, POOLING_MODES
+from plotting import PRECISIONS, REFINEMENT_LEVELS, RESOLUTION, SAMPLING_MODES, expression_parameters, make_settings, render_sweep
+from parallel import default_workers, shutdown as shutdown_workers
+from tracing import configure_logging, format_timings, tracer
+from transport import DEFAULT_TRANSPORT, TRANSPORT_MODES
+from sliders import ParameterSlider
+from worker import RenderPipeline
+from webview import PlotView, register_plot_scheme
+
+logger = logging.getLogger(__name__)
+
+# Time between frames while a parameter plays
+PLAY_INTERVAL_MS = 100
+
+# In live mode a render starts once typing has paused this long
+LIVE_DEBOUNCE_MS = 300
+
+# Borders of inputs that do not parse, and of inputs edited since the last render
+INVALID_STYLE = "border: 1px solid #e05050;"
+DIRTY_STYLE = "border: 1px solid #c8a040;"
 
 class PlotlyApp(QMainWindow):
     def __init__(self):
@@ -37,17 +59,25 @@ class PlotlyApp(QMainWindow):
         grid_layout_graphs.setSpacing(0)
         grid_layout_graphs.setContentsMargins(0, 0, 0, 0)
 
-        self.view = QWebEngineView()
-        grid_layout_graphs.addWidget(self.view, 0, 0)
-
-        self.imaginary_part_view = QWebEngineView()
-        grid_layout_graphs.addWidget(self.imaginary_part_view, 0, 1)
-
-        self.real_part_view = QWebEngineView()
-        grid_layout_graphs.addWidget(self.real_part_view, 1, 0)
-
-        self.real_function_view = QWebEngineView()
-        grid_layout_graphs.addWidget(self.real_function_view, 1, 1)
+        # The web views are created once the window is on screen (see create_views),
+        # until then plain placeholders hold their place in the grid
+        self.view = None
+        self.imaginary_part_view = None
+        self.real_part_view = None
+        self.real_function_view = None
+        self.pending_result = None
+        # Trace signatures the views show, so a render only sends the functions that changed
+        self.displayed = []
+        self.status_text = ""
+        self.redraw_ms = 0.0
+
+        self.grid_layout_graphs = grid_layout_graphs
+        self.view_placeholders = []
+        for row, column in ((0, 0), (0, 1), (1, 0), (1, 1)):
+            placeholder = QLabel("Loading...", self)
+            placeholder.setAlignment(Qt.AlignCenter)
+            grid_layout_graphs.addWidget(placeholder, row, column)
+            self.view_placeholders.append(placeholder)
 
         right_layout.addLayout(grid_layout_graphs)
 
@@ -58,7 +88,33 @@ class PlotlyApp(QMainWindow):
         layout.addWidget(splitter)
 
         self.setCentralWidget(central_widget)
-        self.create_plot()  # Call create_plot without the function initially
+
+        # Busy indicator shown in the status bar while a render is in flight
+        self.busy_indicator = QProgressBar(self)
+        self.busy_indicator.setRange(0, 0)
+        self.busy_indicator.setMaximumWidth(160)
+        self.busy_indicator.setVisible(False)
+        self.statusBar().addPermanentWidget(self.busy_indicator)
+
+        self.render_pipeline = RenderPipeline(self)
+        self.render_pipeline.result_ready.connect(self.show_plots)
+        self.render_pipeline.failed.connect(self.show_error)
+        self.render_pipeline.busy_changed.connect(self.set_busy)
+
+        # Parameter sweeps precompute their frames into the surface cache next to the renders
+        self.sweep_pipeline = RenderPipeline(self, render=render_sweep)
+        self.sweep_pipeline.result_ready.connect(self.show_sweep_progress)
+        self.sweep_pipeline.failed.connect(self.show_error)
+
+        # Playback steps the playing slider, each step renders from the cached frames
+        self.playing = None
+        self.play_timer = QTimer(self)
+        self.play_timer.setInterval(PLAY_INTERVAL_MS)
+        self.play_timer.timeout.connect(self.play_step)
+
+        # Start the first render and the web views after the window is shown
+        QTimer.singleShot(0, self.create_plot)
+        QTimer.singleShot(0, self.create_views)
 
         splitter.setSizes([138, 1800])
         splitter.setStretchFactor(1, 15)
@@ -83,7 +139,7 @@ class PlotlyApp(QMainWindow):
         # New input field for the Z function
         z_layout = QGridLayout()
         self.z_function_input = QLineEdit(self)
-        self.z_function_input.setPlaceholderText("x+i*y")
+        self.z_function_input.setPlaceholderText("X + i*Y")
         self.z_function_label = QLabel("z =", self)
 
         z_layout.addWidget(self.z_function_label, 0, 0)
@@ -98,6 +154,22 @@ class PlotlyApp(QMainWindow):
         update_button.setFixedWidth(120)
         update_button_layout.addWidget(update_button)
 
+        # Live mode renders on its own once typing pauses, as long as every input parses
+        self.live_input = QCheckBox("Live", self)
+        self.live_input.setToolTip("Update the plots while typing")
+        update_button_layout.addWidget(self.live_input)
+
+        self.live_timer = QTimer(self)
+        self.live_timer.setSingleShot(True)
+        self.live_timer.setInterval(LIVE_DEBOUNCE_MS)
+        self.live_timer.timeout.connect(self.live_update)
+
+        # One slider per free name in the expressions (e.g. a and n in z**n + a),
+        # added and removed as the expressions change
+        self.parameter_layout = QVBoxLayout()
+        update_button_layout.addLayout(self.parameter_layout)
+        self.parameter_sliders = {}
+
         # Function input field with the + and - buttons widget
         input_widget = QWidget()
         input_layout = QVBoxLayout()
@@ -235,6 +307,9 @@ class PlotlyApp(QMainWindow):
         for cmap in colormaps:
             self.colormap.addItem(cmap)
 
+        # Surfaces are cached, so a colormap change redraws without re-evaluating
+        self.colormap.currentIndexChanged.connect(self.update_plot)
+
         # X, Y, Z labels and inputs
         x_label = QLabel("X:", self)
         y_label = QLabel("Y:", self)
@@ -267,6 +342,123 @@ class PlotlyApp(QMainWindow):
         grid_layout.addWidget(self.z_min_input, 3, 1)
         grid_layout.addWidget(self.z_max_input, 3, 2)
 
+        # Number of worker processes used to evaluate the functions (1 = serial)
+        workers_label = QLabel("Workers:", self)
+        self.workers_input = QSpinBox(self)
+        self.workers_input.setRange(1, max(default_workers(), 1) * 2)
+        self.workers_input.setValue(default_workers())
+
+        grid_layout.addWidget(workers_label, 4, 0)
+        grid_layout.addWidget(self.workers_input, 4, 1, 1, 2)
+
+        # Precision of the surface data sent to the plots
+        transport_label = QLabel("Data:", self)
+        self.transport_input = QComboBox(self)
+        for mode in TRANSPORT_MODES:
+            self.transport_input.addItem(mode)
+        self.transport_input.setCurrentText(DEFAULT_TRANSPORT)
+
+        grid_layout.addWidget(transport_label, 5, 0)
+        grid_layout.addWidget(self.transport_input, 5, 1, 1, 2)
+
+        # Target grid resolution and number of progressive passes to reach it
+        resolution_label = QLabel("Res:", self)
+        self.resolution_input = QSpinBox(self)
+        # Tiled sampling computes grids far beyond what is plotted
+        self.resolution_input.setRange(10, 20000)
+        self.resolution_input.setValue(RESOLUTION)
+
+        levels_label = QLabel("Levels:", self)
+        self.levels_input = QSpinBox(self)
+        self.levels_input.setRange(1, 5)
+        self.levels_input.setValue(REFINEMENT_LEVELS)
+
+        grid_layout.addWidget(resolution_label, 6, 0)
+        grid_layout.addWidget(self.resolution_input, 6, 1, 1, 2)
+        grid_layout.addWidget(levels_label, 7, 0)
+        grid_layout.addWidget(self.levels_input, 7, 1, 1, 2)
+
+        # Uniform grid, adaptive sampling refined around poles, zeros and branch cuts,
+        # or a full grid computed in tiles to disk and pooled down for display
+        sampling_label = QLabel("Mesh:", self)
+        self.sampling_input = QComboBox(self)
+        for mode in SAMPLING_MODES:
+            self.sampling_input.addItem(mode)
+
+        budget_label = QLabel("Points:", self)
+        self.point_budget_input = QSpinBox(self)
+        self.point_budget_input.setRange(1000, 1000000)
+        self.point_budget_input.setSingleStep(1000)
+        self.point_budget_input.setValue(DEFAULT_POINT_BUDGET)
+
+        grid_layout.addWidget(sampling_label, 8, 0)
+        grid_layout.addWidget(self.sampling_input, 8, 1, 1, 2)
+        grid_layout.addWidget(budget_label, 9, 0)
+        grid_layout.addWidget(self.point_budget_input, 9, 1, 1, 2)
+
+        # Engine for the plotted functions; only the installed ones are listed
+        backend_label = QLabel("Engine:", self)
+        self.backend_input = QComboBox(self)
+        for backend in available_backends():
+            self.backend_input.addItem(backend)
+        self.backend_input.setCurrentText(DEFAULT_BACKEND)
+
+        grid_layout.addWidget(backend_label, 10, 0)
+        grid_layout.addWidget(self.backend_input, 10, 1, 1, 2)
+
+        # Plotted grid size for tiled sampling, and how blocks of samples are pooled into it
+        display_label = QLabel("Display:", self)
+        self.display_resolution_input = QSpinBox(self)
+        self.display_resolution_input.setRange(10, 2000)
+        self.display_resolution_input.setValue(DEFAULT_DISPLAY_RESOLUTION)
+
+        pooling_label = QLabel("Pool:", self)
+        self.pooling_input = QComboBox(self)
+        for mode in POOLING_MODES:
+            self.pooling_input.addItem(mode)
+
+        grid_layout.addWidget(display_label, 11, 0)
+        grid_layout.addWidget(self.display_resolution_input, 11, 1, 1, 2)
+        grid_layout.addWidget(pooling_label, 12, 0)
+        grid_layout.addWidget(self.pooling_input, 12, 1, 1, 2)
+
+        # Magnitude as a 3-D surface or as a flat domain-colored image (hue = phase,
+        # lightness = log magnitude, optionally banded at powers of two)
+        magnitude_view_label = QLabel("Magnitude:", self)
+        self.magnitude_view_input = QComboBox(self)
+        for view in MAGNITUDE_VIEWS:
+            self.magnitude_view_input.addItem(view)
+        self.contours_input = QCheckBox("Contours", self)
+        self.contours_input.setChecked(True)
+
+        grid_layout.addWidget(magnitude_view_label, 13, 0)
+        grid_layout.addWidget(self.magnitude_view_input, 13, 1)
+        grid_layout.addWidget(self.contours_input, 13, 2)
+
+        # Precision of the fields kept per function after evaluation (single halves their memory)
+        precision_label = QLabel("Fields:", self)
+        self.precision_input = QComboBox(self)
+        for precision in PRECISIONS:
+            self.precision_input.addItem(precision)
+
+        grid_layout.addWidget(precision_label, 14, 0)
+        grid_layout.addWidget(self.precision_input, 14, 1, 1, 2)
+
+        # Surface vertices sent to each view; larger grids are decimated down to it
+        vertex_budget_label = QLabel("Vertices:", self)
+        self.vertex_budget_input = QSpinBox(self)
+        self.vertex_budget_input.setRange(1000, 4000000)
+        self.vertex_budget_input.setSingleStep(10000)
+        self.vertex_budget_input.setValue(DEFAULT_VERTEX_BUDGET)
+
+        grid_layout.addWidget(vertex_budget_label, 15, 0)
+        grid_layout.addWidget(self.vertex_budget_input, 15, 1, 1, 2)
+
+        # Writes the recorded stage timings as a Chrome trace (chrome://tracing, Perfetto)
+        export_trace_button = QPushButton("Export Trace", self)
+        export_trace_button.clicked.connect(self.export_trace)
+        grid_layout.addWidget(export_trace_button, 16, 0, 1, 3)
+
         # Add the grid layout for options to options_layout
         options_layout.addLayout(grid_options)
         options_layout.addWidget(self.colormap)
@@ -285,6 +477,61 @@ class PlotlyApp(QMainWindow):
         self.spacer = QSpacerItem(20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding)
         input_layout.addItem(self.spacer)
 
+        # Text of every input at the last render, to tell which ones were edited since
+        self.submitted = {}
+        for field in self.watched_fields():
+            self.watch_field(field)
+
+    def watched_fields(self):
+        ranges = [getattr(self, name + '_input') for name in ('x_min', 'x_max', 'y_min', 'y_max', 'z_min', 'z_max')]
+        return [self.z_function_input] + self.input_fields + ranges
+
+    def watch_field(self, field):
+        field.textChanged.connect(lambda text, field=field: self.on_field_edited(field))
+
+    def field_error(self, field):
+        # Parse an input on its own, without evaluating anything; empty inputs are valid
+        text = field.text().strip()
+        if not text:
+            return None
+        try:
+            if field is self.z_function_input:
+                compile_z_function(text)
+            elif field in self.input_fields:
+                compile_function(text)
+            else:
+                float(text)
+        except (ExpressionError, ValueError) as e:
+            return str(e)
+        return None
+
+    def mark_field(self, field):
+        error = self.field_error(field)
+        dirty = field.text() != self.submitted.get(field, "")
+        field.setStyleSheet(INVALID_STYLE if error else DIRTY_STYLE if dirty else "")
+        field.setToolTip(error or "")
+        return error
+
+    def on_field_edited(self, field):
+        error = self.mark_field(field)
+        if not self.live_input.isChecked():
+            return
+        # Invalid input is only flagged; the plots keep showing the last valid state
+        if error is None:
+            self.live_timer.start()
+        else:
+            self.live_timer.stop()
+
+    def live_update(self):
+        fields = self.watched_fields()
+        if any(self.field_error(field) is not None for field in fields):
+            return
+        # Nothing to do if the edits were undone; otherwise only the edited functions are
+        # evaluated (the others come from the surface cache) and only their traces are sent
+        if len(self.submitted) == len(fields) and all(field.text() == self.submitted.get(field) for field in fields):
+            return
+        self.create_plot()
+
     def add_input_field(self):
         # Create a new input field
         new_input_field = QLineEdit(self)
@@ -295,6 +542,7 @@ class PlotlyApp(QMainWindow):
 
         # Append the new input field to the list
         self.input_fields.append(new_input_field)
+        self.watch_field(new_input_field)
 
         # Show the remove button if there's more than one input field
         if len(self.input_fields) > 1:
@@ -304,231 +552,218 @@ class PlotlyApp(QMainWindow):
         # Only remove input field if there are more than 1 input field
         if len(self.input_fields) > 1:
             last_input_field = self.input_fields.pop()
+            self.submitted.pop(last_input_field, None)
             last_input_field.deleteLater()
+            if self.live_input.isChecked():
+                self.live_timer.start()
 
             # Hide the remove button if there is only 1 input field left
             if len(self.input_fields) == 1:
                 self.remove_button.setVisible(False)
 
-    def create_plot(self):
-        # Prepare layout settings
-        layout_settings = dict(
-            plot_bgcolor='#121212',
-            paper_bgcolor='#121212',
-            font=dict(color='#e0e0e0')
+    def read_settings(self):
+        # Take a snapshot of the inputs on the UI thread
+        ranges = {}
+        for name in ('x_min', 'x_max', 'y_min', 'y_max', 'z_min', 'z_max'):
+            text = getattr(self, name + '_input').text()
+            ranges[name] = float(text) if text else None
+
+        settings = make_settings(
+            z_function=self.z_function_input.text(),
+            functions=[field.text() for field in self.input_fields],
+            colorscale=self.colormap.currentText(),
+            workers=self.workers_input.value(),
+            transport=self.transport_input.currentText(),
+            resolution=self.resolution_input.value(),
+            levels=self.levels_input.value(),
+            sampling=self.sampling_input.currentText(),
+            point_budget=self.point_budget_input.value(),
+            backend=self.backend_input.currentText(),
+            display_resolution=self.display_resolution_input.value(),
+            pooling=self.pooling_input.currentText(),
+            magnitude_view=self.magnitude_view_input.currentText(),
+            contours=self.contours_input.isChecked(),
+            precision=self.precision_input.currentText(),
+            vertex_budget=self.vertex_budget_input.value(),
+            parameters={name: slider.value() for name, slider in self.parameter_sliders.items()},
+            displayed=self.displayed,
+            **ranges
         )
 
-        # Get the user input for the Z function (defaulting to "X + 1j * Y" if empty)
-        z_function = self.z_function_input.text().strip()
-        if not z_function:
-            z_function = "X + 1j * Y"  # Default value if the input is empty
-
-        # Sanitize the z_function (replace i with 1j)
-        z_function = z_function.replace('i', '1j')
-
-        # Debugging: Check the z_function input
-        print(f"User input for z_function: {z_function}")
-
-        # Initialize figures
-        fig_real_part = go.Figure()
-        fig_imaginary_part = go.Figure()
-        fig_3d = go.Figure()
-        fig_real = go.Figure()
-
-        # Loop through the input fields for the functions
-        for idx, field in enumerate(self.input_fields):
-            func_expr = field.text().strip()
-
-            # Sanitize function input
-            func_expr = self.sanitize_function_input(func_expr)
-
-            # Debugging: Check the function input
-            print(f"User input for func_expr {idx}: {func_expr}")
-
-            if not any(var in func_expr for var in ['z', '1j']):  # Add z if not present in the expression
-                func_expr = f"({func_expr}) + 0*z"
-
-            # Define safe locals (mathematical functions)
-            safe_locals = {
-                'np': np,
-                'sin': np.sin,
-                'cos': np.cos,
-                'tan': np.tan,
-                'cot': lambda x: 1 / np.tan(x),
-                'sqrt': np.sqrt,
-                'log': np.log,
-                'exp': np.exp,
-                'abs': np.abs,
-                'arctan': np.arctan,
-                'arccot': lambda x: np.pi / 2 - np.arctan(x),
-                'arccos': np.arccos,
-                'arcsin': np.arcsin,
-                'angle': np.angle,
-                'vstack': np.vstack,
-                'hstack': np.hstack,
-                'dstack': np.dstack,
-                'column_stack': np.column_stack,
-                'transpose': np.transpose,
-                'gamma': special.gamma,
-                'factorial': lambda x: special.gamma(x + 1)
-            }
+        logger.debug("User input for z_function: %s", settings['z_function'])
+        for idx, func_expr in enumerate(settings['functions']):
+            logger.debug("User input for func_expr %d: %s", idx, func_expr)
 
-            # Define a function that will evaluate the expressions
-            def f(z):
-                # Replace X, Y with the real and imaginary parts of z in z_function only
-                z_expr = z_function.replace('X', 'z.real').replace('Y', 'z.imag')
-                try:
-                    z_value = eval(z_expr, {"__builtins__": None}, {'z': z, 'X': z.real, 'Y': z.imag})
-                except Exception as e:
-                    print(f"Error in evaluating z_function: {e}")
-                    return None
-
-                # Debugging: Check how f(z) is being evaluated
-                print(f"Evaluating function f(z) for z={z_value}: {func_expr}")
-                try:
-                    result = eval(func_expr, {"__builtins__": None}, {**safe_locals, 'z': z_value, 'X': z_value.real, 'Y': z_value.imag})
-                    return result
-                except Exception as e:
-                    print(f"Error in evaluating function expression: {e}")
-                    return None
-
-            try:
-                x_min = float(self.x_min_input.text()) if self.x_min_input.text() else -2
-                x_max = float(self.x_max_input.text()) if self.x_max_input.text() else 2
-                y_min = float(self.y_min_input.text()) if self.y_min_input.text() else -2
-                y_max = float(self.y_max_input.text()) if self.y_max_input.text() else 2
-                z_min = float(self.z_min_input.text()) if self.z_min_input.text() else -5
-                z_max = float(self.z_max_input.text()) if self.z_max_input.text() else 5
-
-                x = np.linspace(x_min, x_max, 200)
-                y = np.linspace(y_min, y_max, 200)
-                X, Y = np.meshgrid(x, y)
-                
-                # Dynamically generate Z based on the user's input for the Z function
-                Z = eval(z_function.replace('X', 'X').replace('Y', 'Y'))
-                F = f(Z)
-
-                if F is None:
-                    print("Error: f(Z) returned None.")
-                    return  # Early exit if f(Z) is None
-
-            except Exception as e:
-                print(f"Error: {e}")
-                return e
-
-            if F is None:
-                print("Error: f(z) is None, skipping plot creation.")
-                return
-
-            magnitude = np.abs(F)
-            phase = np.angle(F) / np.pi
-
-            self.colorscale = self.colormap.currentText()
-
-            colorscale_settings = dict(
-                colorscale=self.colorscale,
-                colorbar=dict(
-                    title="Phase (π units)",
-                    tickvals=[-1, -0.5, 0, 0.5, 1],
-                    ticktext=["-π", "-π/2", "0", "π/2", "π"],
-                    tickmode="array"
-                )
-            )
-
-            # Real part trace
-            fig_real_part.add_trace(go.Surface(
-                z=np.real(F), x=X, y=Y, surfacecolor=phase, **colorscale_settings
-            ))
-
-            # Imaginary part trace
-            fig_imaginary_part.add_trace(go.Surface(
-                z=np.imag(F), x=X, y=Y, surfacecolor=phase, **colorscale_settings
-            ))
-
-            # Magnitude part trace
-            fig_3d.add_trace(go.Surface(
-                z=magnitude, x=X, y=Y, surfacecolor=phase, **colorscale_settings
-            ))
-
-            # Real part of the function trace
-            real_z = np.linspace(x_min, x_max, 200)
-            F_real = f(real_z)
-            fig_real.add_trace(go.Scatter(x=real_z, y=np.real(F_real), mode='lines', line=dict(color='blue')))
-
-        # Apply Z-axis limits to each plot
-        z_axis_limits = dict(range=[z_min, z_max])
-
-        fig_real_part.update_layout(
-            title="Real Part of f(z)",
-            scene=dict(
-                xaxis_title="Re(z)",
-                yaxis_title="Im(z)",
-                zaxis_title="Re(f(z))",
-                zaxis=z_axis_limits
-            ),
-            **layout_settings
-        )
+        return settings
 
-        fig_imaginary_part.update_layout(
-            title="Imaginary Part of f(z)",
-            scene=dict(
-                xaxis_title="Re(z)",
-                yaxis_title="Im(z)",
-                zaxis_title="Im(f(z))",
-                zaxis=z_axis_limits
-            ),
-            **layout_settings
+    def create_plot(self):
+        try:
+            settings = self.read_settings()
+        except Exception as e:
+            logger.error("Invalid settings: %s", e)
+            self.statusBar().showMessage(f"Error: {e}")
+            return e
+
+        self.colorscale = settings['colorscale']
+
+        self.live_timer.stop()
+        self.submitted = {field: field.text() for field in self.watched_fields()}
+        for field in self.submitted:
+            self.mark_field(field)
+
+        # Sliders follow the parameters of the current expressions; invalid expressions
+        # keep the sliders as they are, the render reports the error
+        try:
+            names = expression_parameters(settings)
+        except ExpressionError:
+            names = None
+        if names is not None and names != list(self.parameter_sliders):
+            self.update_parameter_sliders(names)
+            settings['parameters'] = {name: slider.value() for name, slider in self.parameter_sliders.items()}
+
+        # Evaluation, figure building and serialization run in the background
+        self.render_pipeline.submit(settings)
+
+    def update_parameter_sliders(self, names):
+        for name in list(self.parameter_sliders):
+            if name not in names:
+                if self.playing == name:
+                    self.stop_playing()
+                self.parameter_sliders.pop(name).deleteLater()
+
+        # Existing sliders keep their value and range, new ones are added in order
+        sliders = {}
+        for name in names:
+            slider = self.parameter_sliders.get(name)
+            if slider is None:
+                slider = ParameterSlider(name, self)
+                slider.value_changed.connect(self.update_plot)
+                slider.sweep_requested.connect(self.sweep_parameter)
+                slider.play_toggled.connect(self.toggle_playing)
+            self.parameter_layout.addWidget(slider)
+            sliders[name] = slider
+        self.parameter_sliders = sliders
+
+    def sweep_parameter(self, name):
+        try:
+            settings = self.read_settings()
+        except Exception as e:
+            self.show_error(str(e))
+            return
+        slider = self.parameter_sliders[name]
+        settings['sweep'] = (name, slider.values())
+        self.sweep_pipeline.submit(settings)
+
+    def show_sweep_progress(self, result):
+        self.statusBar().showMessage(
+            f"Sweep {result['sweep']}: {result['done']}/{result['total']} frames cached | {format_timings(result['timings'])}"
         )
 
-        fig_3d.update_layout(
-            title="Magnitude of f(z)",
-            scene=dict(
-                xaxis_title="Re(z)",
-                yaxis_title="Im(z)",
-                zaxis_title="|f(z)|",
-                zaxis=dict(range=[0, z_max])
-            ),
-            **layout_settings
+    def toggle_playing(self, name, playing):
+        if not playing:
+            if self.playing == name:
+                self.stop_playing()
+            return
+
+        # One parameter plays at a time; its frames are precomputed while it plays
+        if self.playing is not None and self.playing != name:
+            self.parameter_sliders[self.playing].play_button.setChecked(False)
+        self.playing = name
+        self.sweep_parameter(name)
+        self.play_timer.start()
+
+    def stop_playing(self):
+        self.play_timer.stop()
+        self.playing = None
+
+    def play_step(self):
+        # Frames are not queued up: the next step waits until the last one has been rendered
+        if self.playing is None or self.render_pipeline.is_busy():
+            return
+        self.parameter_sliders[self.playing].step()
+
+    def create_views(self):
+        views = (
+            ('view', 'magnitude', 0, 0),
+            ('imaginary_part_view', 'imaginary_part', 0, 1),
+            ('real_part_view', 'real_part', 1, 0),
+            ('real_function_view', 'real_function', 1, 1),
         )
-
-        fig_real.update_layout(
-            title="Real Function f(z)",
-            scene=dict(
-                xaxis_title="z",
-                yaxis_title="f(z)",
-            ),
-            **layout_settings
+        for placeholder, (attribute, name, row, column) in zip(self.view_placeholders, views):
+            view = PlotView(name)
+            view.redrawn.connect(self.show_redraw_time)
+            self.grid_layout_graphs.removeWidget(placeholder)
+            placeholder.deleteLater()
+            self.grid_layout_graphs.addWidget(view, row, column)
+            setattr(self, attribute, view)
+        self.view_placeholders = []
+
+        # A render that finished before the views existed is shown now
+        if self.pending_result is not None:
+            result, self.pending_result = self.pending_result, None
+            self.show_plots(result)
+
+    def show_plots(self, result):
+        if self.view is None:
+            self.pending_result = result
+            return
+
+        # The pages stay loaded, only the figure data is pushed into them
+        payloads = result['payloads']
+        self.view.show_figure(payloads['magnitude'])
+        self.imaginary_part_view.show_figure(payloads['imaginary_part'])
+        self.real_part_view.show_figure(payloads['real_part'])
+        self.real_function_view.show_figure(payloads['real_function'])
+
+        # Pages that are still loading only keep the newest figure, whose traces must then be complete
+        views = (self.view, self.imaginary_part_view, self.real_part_view, self.real_function_view)
+        self.displayed = result['signatures'] if all(view.ready for view in views) else []
+
+        payload_bytes = sum(len(payload) for payload in payloads.values())
+        resolution = result['resolution']
+        self.status_text = (
+            f"{resolution}x{resolution} (pass {result['level']}/{result['levels']}), payload: {payload_bytes / 1e6:.2f} MB"
         )
-
-        # Save and display plots
-        temp_file_real_part = tempfile.NamedTemporaryFile(delete=False, suffix=".html")
-        fig_real_part.write_html(temp_file_real_part.name)
-        self.real_part_view.load(QUrl.fromLocalFile(temp_file_real_part.name))
-
-        temp_file_imaginary_part = tempfile.NamedTemporaryFile(delete=False, suffix=".html")
-        fig_imaginary_part.write_html(temp_file_imaginary_part.name)
-        self.imaginary_part_view.load(QUrl.fromLocalFile(temp_file_imaginary_part.name))
-
-        temp_file_3d = tempfile.NamedTemporaryFile(delete=False, suffix=".html")
-        fig_3d.write_html(temp_file_3d.name)
-        self.view.load(QUrl.fromLocalFile(temp_file_3d.name))
-
-        temp_file_real_func_2d = tempfile.NamedTemporaryFile(delete=False, suffix=".html")
-        fig_real.write_html(temp_file_real_func_2d.name)
-        self.real_function_view.load(QUrl.fromLocalFile(temp_file_real_func_2d.name))
-
-    def sanitize_function_input(self, func_expr):
-        # Replace 'i' with '1j' when it's standalone or part of an expression like z + i
-        func_expr = re.sub(r'(?<![a-zA-Z0-9\(\)])\bi\b(?![a-zA-Z0-9\)])', '1j', func_expr)
-
-        # Replace i after a '+' or '-' sign when it's part of an expression, like in z + i or z - i
-        func_expr = re.sub(r'(?<=\+|\-)\s*i\s*', '1j', func_expr)
-
-        # Handle cases where i is part of an exponentiation expression (e.g., **i or ** 1j)
-        func_expr = re.sub(r'(?<=\*\*)\s*i\s*', '**1j', func_expr)
-
-        # Return the sanitized function expression
-        return func_expr
+        vertices = result.get('vertices')
+        if vertices and vertices['computed']:
+            self.status_text += f", vertices: {vertices['sent']} of {vertices['computed']}"
+        timings = format_timings(result.get('timings', {}))
+        if timings:
+            self.status_text += f" | {timings}"
+        self.redraw_ms = 0.0
+        self.statusBar().showMessage(self.status_text)
+
+    def show_redraw_time(self, milliseconds):
+        # The four views redraw concurrently, the slowest one is what the user waits for
+        self.redraw_ms = max(self.redraw_ms, milliseconds)
+        self.statusBar().showMessage(f"{self.status_text} · redraw {self.redraw_ms:.1f} ms")
+
+    def export_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Trace", "trace.json", "Trace files (*.json)")
+        if not path:
+            return
+        try:
+            count = tracer.export(path)
+        except OSError as e:
+            self.show_error(str(e))
+            return
+        self.statusBar().showMessage(f"Trace written to {path} ({count} spans)")
+
+    def show_error(self, message):
+        logger.error("%s", message)
+        self.statusBar().showMessage(f"Error: {message}")
+
+    def set_busy(self, busy):
+        self.busy_indicator.setVisible(busy)
+
+    def closeEvent(self, event):
+        self.play_timer.stop()
+        self.sweep_pipeline.shutdown()
+        self.render_pipeline.shutdown()
+        if surface_cache.store is not None:
+            surface_cache.store.close()
+        shutdown_workers()
+        super().closeEvent(event)
 
     def update_plot(self):
         self.create_plot()  # Call create_plot to update the graphs
@@ -570,8 +805,15 @@ def set_dark_mode(app):
     """
     app.setStyleSheet(dark_stylesheet)
 
-app = QApplication(sys.argv)
-set_dark_mode(app)
-main_window = PlotlyApp()
-main_window.showMaximized()
-sys.exit(app.exec_())
+if __name__ == "__main__":
+    # Verbosity comes from COMPLEX_PLOT_LOG_LEVEL (DEBUG shows inputs, cache and payload details)
+    configure_logging()
+    # Surfaces evaluated in earlier sessions are loaded from disk instead of recomputed
+    # (COMPLEX_PLOT_CACHE_DIR, COMPLEX_PLOT_CACHE_MB)
+    surface_cache.store = open_store()
+    register_plot_scheme()
+    app = QApplication(sys.argv)
+    set_dark_mode(app)
+    main_window = PlotlyApp()
+    main_window.showMaximized()
+    sys.exit(app.exec_())
@@ -0,0 +1,163 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from expression import compile_function
+from planner import evaluate_all, split_functions
+
+# Below this many samples (over all functions) the pool overhead outweighs the gain
+MIN_PARALLEL_SAMPLES = 100_000
+
+_executor = None
+_executor_workers = 0
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def _init_worker():
+    # Tiles already run in parallel across processes, so numexpr stays single threaded in each
+    os.environ['NUMEXPR_NUM_THREADS'] = '1'
+
+
+def get_executor(workers):
+    # The pool is kept alive between updates so workers only pay their imports once
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != workers:
+        shutdown()
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker)
+        _executor_workers = workers
+    return _executor
+
+
+def shutdown():
+    global _executor, _executor_workers
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    _executor_workers = 0
+
+
+class SharedArray:
+    # A numpy array backed by a named shared memory block, so workers can attach without pickling
+
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        if self.owner:
+            nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            # Spawned workers share the parent's resource tracker, which unlinks the block
+            # only once the owner does
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @property
+    def spec(self):
+        return (self.shm.name, self.shape, self.dtype.str)
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, dtype = spec
+        return cls(shape, dtype, name=name)
+
+    def close(self):
+        # Views on the buffer must be dropped before the block can be closed
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _evaluate_tile(func_exprs, indices, row_start, row_stop, z_spec, out_spec, backend, parameters):
+    z_shared = SharedArray.attach(z_spec)
+    out_shared = SharedArray.attach(out_spec)
+    try:
+        functions = [compile_function(func_expr) for func_expr in func_exprs]
+        Z = z_shared.array[row_start:row_stop]
+        for index, F in zip(indices, evaluate_all(functions, Z, backend, parameters)):
+            out_shared.array[index, row_start:row_stop] = F
+        del Z, F
+    finally:
+        z_shared.close()
+        out_shared.close()
+
+
+def _row_tiles(rows, count):
+    step = math.ceil(rows / max(count, 1))
+    return [(start, min(start + step, rows)) for start in range(0, rows, step)]
+
+
+def evaluate_functions(functions, Z, workers=None, is_cancelled=None, min_samples=MIN_PARALLEL_SAMPLES,
+                       backend='numpy', parameters=None):
+    # Evaluate every function over the same Z grid. Functions sharing subexpressions are evaluated
+    # together through one plan (see planner.py), the others on their own; each such group
+    # (or row tile of one) is a task. Functions that are not elementwise (transpose(z), z.T, ...)
+    # need the whole grid and may change its shape, they are evaluated in this process while
+    # the workers run the tiles.
+    # Returns a list of result grids, or None if the render was cancelled on the way.
+    workers = default_workers() if workers is None else workers
+
+    # Validate in this process first, so bad input fails fast with the usual error
+    compiled = [compile_function(func_expr) for func_expr in functions]
+
+    if workers <= 1 or len(functions) == 0 or Z.size * len(functions) < min_samples:
+        if is_cancelled is not None and is_cancelled():
+            return None
+        return evaluate_all(compiled, Z, backend, parameters)
+
+    planned, separate = split_functions(compiled, backend)
+    whole = [index for index in separate if not compiled[index].elementwise]
+    groups = ([planned] if planned else []) + [[index] for index in separate if index not in whole]
+    if not groups:
+        if is_cancelled is not None and is_cancelled():
+            return None
+        return evaluate_all(compiled, Z, backend, parameters)
+
+    # Split each group into row tiles so every worker has something to do
+    tiles_per_group = max(1, math.ceil(workers / len(groups)))
+    tiles = _row_tiles(Z.shape[0], tiles_per_group)
+
+    executor = get_executor(workers)
+    with SharedArray(Z.shape, complex) as z_shared, \
+            SharedArray((len(functions),) + Z.shape, complex) as out_shared:
+        z_shared.array[...] = Z
+
+        futures = [
+            executor.submit(_evaluate_tile, [functions[index] for index in group], group, start, stop,
+                            z_shared.spec, out_shared.spec, backend, parameters)
+            for group in groups
+            for start, stop in tiles
+        ]
+
+        results = {index: evaluate_all([compiled[index]], Z, backend, parameters)[0] for index in whole}
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.05, return_when=FIRST_EXCEPTION)
+            failed = [future for future in done if future.exception() is not None]
+            cancelled = is_cancelled is not None and is_cancelled()
+            if failed or cancelled:
+                # Let running tiles finish before the shared blocks go away
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+                if failed:
+                    raise failed[0].exception()
+                return None
+
+        return [results[index] if index in whole else out_shared.array[index].copy() for index in range(len(functions))]
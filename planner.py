@@ -0,0 +1,206 @@
+import ast
+import logging
+from functools import lru_cache
+
+import numpy as np
+
+from expression import DEFAULT_PARAMETER_VALUE, FUNCTION_VARIABLES, SAFE_FUNCTIONS, evaluate_function
+
+logger = logging.getLogger(__name__)
+
+# Leaves of the graph that are arrays; everything else (parameters, constants) is a scalar
+ARRAY_LEAVES = FUNCTION_VARIABLES
+
+
+@lru_cache(maxsize=512)
+def _template_function(template, arity):
+    # One compiled step of a plan, e.g. "sin(_0)" or "_0 * _1 + 1" as a function of its inputs
+    arguments = ", ".join(f"_{index}" for index in range(arity))
+    return eval(f"lambda {arguments}: {template}", {'__builtins__': {}, **SAFE_FUNCTIONS})
+
+
+class Plan:
+    # One graph over several functions of the same mapped grid: every distinct subexpression
+    # (e.g. the z**2 in exp(z**2), z**2 + 1 and sin(z**2)) is a node evaluated once, and each
+    # intermediate array is freed as soon as the last node that reads it has been evaluated.
+    # Nodes are created children first, so their order is an evaluation order.
+
+    def __init__(self, keys):
+        self.keys = keys
+        # (template, children) per node; leaves have a name as template and no children
+        self.nodes = []
+        self.index = {}
+        self.is_array = []
+        # Array operations of evaluating every function on its own, repeated subterms included
+        self.separate_ops = 0
+        # Nodes used by each function
+        self.function_nodes = []
+
+        self.outputs = []
+        for key in keys:
+            self.function_nodes.append(set())
+            self.outputs.append(self.add(ast.parse(key, mode='eval').body))
+
+        self.last_use = {}
+        for node, (_, children) in enumerate(self.nodes):
+            for child in children:
+                self.last_use[child] = node
+        self.kept = set(self.outputs)
+
+    @property
+    def planned_ops(self):
+        return sum(1 for node, (_, children) in enumerate(self.nodes) if children and self.is_array[node])
+
+    @property
+    def saved_ops(self):
+        return self.separate_ops - self.planned_ops
+
+    def shared(self):
+        # Indices of the functions that compute an array subexpression some other function needs too
+        operations = [
+            {node for node in nodes if self.nodes[node][1] and self.is_array[node]}
+            for nodes in self.function_nodes
+        ]
+        return {
+            index for index, nodes in enumerate(operations)
+            if any(nodes & others for other, others in enumerate(operations) if other != index)
+        }
+
+    def node(self, template, children, is_array):
+        key = (template, children)
+        if key not in self.index:
+            self.index[key] = len(self.nodes)
+            self.nodes.append(key)
+            self.is_array.append(is_array)
+        self.function_nodes[-1].add(self.index[key])
+        return self.index[key]
+
+    def add(self, tree):
+        if isinstance(tree, ast.Name) and tree.id not in SAFE_FUNCTIONS:
+            # z, X, Y or a parameter
+            return self.node(tree.id, (), tree.id in ARRAY_LEAVES)
+
+        # Replace every operand of this node that is itself computed by a reference to its node;
+        # constants, function names and np.<name> stay in the template
+        children = []
+
+        def operand(child):
+            if isinstance(child, ast.Constant) or (isinstance(child, ast.Name) and child.id in SAFE_FUNCTIONS):
+                return child
+            children.append(self.add(child))
+            return ast.Name(id=f"_{len(children) - 1}", ctx=ast.Load())
+
+        tree = _replace_operands(tree, operand)
+        children = tuple(children)
+        is_array = any(self.is_array[child] for child in children)
+        if is_array:
+            self.separate_ops += 1
+        return self.node(ast.unparse(tree), children, is_array)
+
+    def evaluate(self, z_value, parameters=None):
+        # Values of every function on the mapped grid, in the order of the keys
+        parameters = parameters or {}
+        leaves = dict(z=z_value, X=z_value.real, Y=z_value.imag)
+        values = {}
+        for node, (template, children) in enumerate(self.nodes):
+            if not children and template in leaves:
+                values[node] = leaves[template]
+            elif not children and template.isidentifier() and template not in SAFE_FUNCTIONS:
+                values[node] = float(parameters.get(template, DEFAULT_PARAMETER_VALUE))
+            else:
+                values[node] = _template_function(template, len(children))(*(values[child] for child in children))
+
+            # An operand can appear more than once, as in z * z
+            for child in dict.fromkeys(children):
+                if self.last_use[child] == node and child not in self.kept:
+                    del values[child]
+
+        results = []
+        for output in self.outputs:
+            result = np.asarray(values[output])
+            if result.shape != z_value.shape:
+                result = np.zeros_like(z_value) + result
+            results.append(result)
+        return results
+
+    def report(self):
+        return dict(functions=len(self.keys), nodes=len(self.nodes), separate_ops=self.separate_ops,
+                    planned_ops=self.planned_ops, saved_ops=self.saved_ops)
+
+
+def _replace_operands(tree, operand):
+    # Shallow copy of tree with operand() applied to each operand expression
+    if isinstance(tree, ast.BinOp):
+        return ast.BinOp(left=operand(tree.left), op=tree.op, right=operand(tree.right))
+    if isinstance(tree, ast.UnaryOp):
+        return ast.UnaryOp(op=tree.op, operand=operand(tree.operand))
+    if isinstance(tree, ast.Compare):
+        return ast.Compare(left=operand(tree.left), ops=tree.ops,
+                           comparators=[operand(child) for child in tree.comparators])
+    if isinstance(tree, ast.Call):
+        func = tree.func
+        if isinstance(func, ast.Attribute):
+            # Method calls such as z.conjugate()
+            func = ast.Attribute(value=operand(func.value), attr=func.attr, ctx=ast.Load())
+        return ast.Call(func=func, args=[operand(child) for child in tree.args], keywords=[])
+    if isinstance(tree, ast.Attribute):
+        return ast.Attribute(value=operand(tree.value), attr=tree.attr, ctx=ast.Load())
+    return tree
+
+
+@lru_cache(maxsize=64)
+def plan_functions(keys):
+    # keys are the canonical forms of elementwise functions (CompiledExpression.key)
+    plan = Plan(keys)
+    logger.debug("Plan for %s: %s", ", ".join(keys), plan.report())
+    return plan
+
+
+def split_functions(functions, backend='numpy'):
+    # Indices of the functions evaluated through one shared plan, and of the ones evaluated
+    # on their own. numpy evaluates every elementwise function through the plan. The other
+    # backends keep their fused kernels, except for functions that fall back to numpy anyway;
+    # 'auto' also plans the functions that share a subexpression, computing that once beats
+    # fusing it into every kernel.
+    candidates = [index for index, function in enumerate(functions) if function.elementwise]
+    if backend == 'numpy':
+        planned = candidates
+    else:
+        from backends import select_kernel
+
+        shared = set()
+        if backend == 'auto':
+            plan = plan_functions(tuple(functions[index].key for index in candidates))
+            shared = {candidates[index] for index in plan.shared()}
+        planned = [
+            index for index in candidates
+            if index in shared or functions[index].parameters or select_kernel(functions[index], backend)[0] == 'numpy'
+        ]
+
+    # A plan of one function does the same work as the function itself
+    if len(planned) < 2:
+        planned = []
+    return planned, [index for index in range(len(functions)) if index not in planned]
+
+
+def evaluate_all(functions, z_value, backend='numpy', parameters=None):
+    # Evaluate several functions on the same mapped grid, sharing their common subexpressions
+    planned, separate = split_functions(functions, backend)
+    results = [None] * len(functions)
+
+    if planned:
+        plan = plan_functions(tuple(functions[index].key for index in planned))
+        for index, result in zip(planned, plan.evaluate(z_value, parameters)):
+            results[index] = result
+
+    for index in separate:
+        results[index] = evaluate_function(functions[index], z_value, backend, parameters)
+    return results
+
+
+def plan_report(functions, backend='numpy'):
+    # Array operations of the planned functions, evaluated separately against through the plan
+    planned, _ = split_functions(functions, backend)
+    if not planned:
+        return dict(functions=0, nodes=0, separate_ops=0, planned_ops=0, saved_ops=0)
+    return plan_functions(tuple(functions[index].key for index in planned)).report()
@@ -0,0 +1,658 @@
+import logging
+
+import numpy as np
+
+from expression import DEFAULT_Z_FUNCTION, compile_z_function, compile_function, evaluate_z, evaluate_function
+from parallel import default_workers, evaluate_functions
+from cache import grid_cache, grid_key, surface_cache, surface_key
+from adaptive import DEFAULT_POINT_BUDGET, adaptive_mesh
+from backends import DEFAULT_BACKEND
+from clipping import DEFAULT_VERTEX_BUDGET, clip_grid, clip_mesh, mask_range
+from domain import domain_trace
+from planner import plan_report
+from tiled import DEFAULT_DISPLAY_RESOLUTION, TILE_DIR, display_axis, tile_path, tiled_grids
+from tracing import span, tracer
+from transport import DEFAULT_TRANSPORT, encode_phase, encode_phase_ticks, encode_values, figure_to_json, phase_range, transport_mode
+
+logger = logging.getLogger(__name__)
+
+# Number of samples along each axis of the grid
+RESOLUTION = 200
+
+# Number of progressively finer passes rendered per update (1 = render the target directly)
+REFINEMENT_LEVELS = 3
+
+# Grids are evaluated in double precision; the derived fields kept for display
+# can be single precision, which halves their memory
+PRECISIONS = dict(double='float64', single='float32')
+
+# Samples per chunk of the fused derive pass, small enough for the chunk to stay in cache
+DERIVE_CHUNK = 1 << 15
+
+# Grids of real values, kept (and cached) for every function instead of the complex grid
+FIELDS = ('real', 'imag', 'magnitude', 'phase')
+
+# Default plot ranges used when an input is left empty
+DEFAULT_RANGES = dict(x_min=-2, x_max=2, y_min=-2, y_max=2, z_min=-5, z_max=5)
+
+LAYOUT_SETTINGS = dict(
+    plot_bgcolor='#121212',
+    paper_bgcolor='#121212',
+    font=dict(color='#e0e0e0'),
+    # Keep camera and zoom when the page is updated in place
+    uirevision='plot'
+)
+
+# Uniform grids are drawn as surfaces, adaptive samples as triangulated meshes
+SAMPLING_MODES = ('uniform', 'adaptive', 'tiled')
+
+# Names of the four plots, in the order they are shown
+VIEW_NAMES = ('magnitude', 'imaginary_part', 'real_part', 'real_function')
+
+# Settings that change a function's traces beyond its surface; z_min/z_max decide which samples
+# are clipped away (see build_figures)
+TRACE_SETTINGS = ('colorscale', 'transport', 'magnitude_view', 'contours', 'z_min', 'z_max')
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+def check_cancelled(is_cancelled):
+    if is_cancelled is not None and is_cancelled():
+        raise RenderCancelled()
+
+
+def make_settings(z_function="", functions=(), colorscale="Viridis", workers=None, transport=DEFAULT_TRANSPORT,
+                  resolution=RESOLUTION, levels=REFINEMENT_LEVELS, sampling='uniform', point_budget=DEFAULT_POINT_BUDGET,
+                  backend=DEFAULT_BACKEND, display_resolution=DEFAULT_DISPLAY_RESOLUTION, pooling='max',
+                  tile_dir=TILE_DIR, magnitude_view='surface', contours=True, precision='double', parameters=None,
+                  displayed=(), vertex_budget=DEFAULT_VERTEX_BUDGET, **ranges):
+    # Snapshot of everything a render needs, so it can run away from the widgets
+    settings = dict(DEFAULT_RANGES)
+    settings.update((key, value) for key, value in ranges.items() if value is not None)
+    settings.update(
+        z_function=z_function.strip() or DEFAULT_Z_FUNCTION,
+        functions=[text.strip() for text in functions],
+        colorscale=colorscale,
+        resolution=resolution,
+        levels=levels,
+        sampling=sampling,
+        point_budget=point_budget,
+        workers=default_workers() if workers is None else workers,
+        transport=transport,
+        backend=backend,
+        display_resolution=display_resolution,
+        pooling=pooling,
+        tile_dir=tile_dir,
+        magnitude_view=magnitude_view,
+        contours=contours,
+        precision=precision,
+        # Surface vertices sent per view, see clipping.clip_grid
+        vertex_budget=vertex_budget,
+        # Values of the free names in the expressions, see expression.parameter_values
+        parameters=dict(parameters or {}),
+        # Trace signatures the views currently show, one per function (see render_plots)
+        displayed=list(displayed)
+    )
+    return settings
+
+
+def derive_surface(F, F_real, precision='double'):
+    # Everything the figures need from one function, computed once and cached: real and
+    # imaginary part, magnitude and phase (in π units), straight into preallocated outputs.
+    # When F has to be cast to the output precision, each chunk is cast once and every field is
+    # computed from it while it is still in cache; otherwise whole-array calls are faster.
+    # The fields share one allocation: large enough for numpy to back it with huge pages,
+    # where four separate ones would each be faulted in page by page.
+    dtype = np.dtype(PRECISIONS[precision])
+    F = np.asarray(F)
+    with span('derive', points=F.size, precision=precision):
+        block = np.empty((len(FIELDS),) + F.shape, dtype=dtype)
+        surface = dict(zip(FIELDS, block))
+        samples = F.reshape(-1)
+        real, imag, magnitude, phase = (field.reshape(-1) for field in block)
+        complex_dtype = np.result_type(dtype, np.complex64)
+        # Without a cast the whole array is one chunk
+        chunk_size = samples.size if samples.dtype == complex_dtype else DERIVE_CHUNK
+        scratch = None if samples.dtype == complex_dtype else np.empty(min(DERIVE_CHUNK, samples.size), complex_dtype)
+
+        with np.errstate(all='ignore'):
+            for start in range(0, samples.size, max(chunk_size, 1)):
+                chunk = slice(start, start + chunk_size)
+                values = samples[chunk]
+                if scratch is not None:
+                    values = scratch[:len(values)]
+                    np.copyto(values, samples[chunk], casting='unsafe')
+                np.copyto(real[chunk], values.real)
+                np.copyto(imag[chunk], values.imag)
+                # Complex abs is vectorized in numpy, hypot on the parts is several times slower
+                np.abs(values, out=magnitude[chunk])
+                np.arctan2(imag[chunk], real[chunk], out=phase[chunk])
+                phase[chunk] *= 1 / np.pi
+
+        surface['F_real'] = np.asarray(F_real).astype(np.result_type(dtype, np.complex64), copy=False)
+        return surface
+
+
+def surface_values(surface):
+    # The complex grid of a derived surface
+    return surface['real'] + 1j * surface['imag']
+
+
+def real_axis_row(y, z_function, function):
+    # Index of the grid row on the real axis, whose samples equal the real-line evaluation,
+    # or None if the grid has no such row or the expressions do not map samples one by one
+    if not (z_function.elementwise and function.elementwise):
+        return None
+    rows = np.flatnonzero(y == 0)
+    return int(rows[0]) if len(rows) else None
+
+
+def refinement_levels(resolution, levels):
+    # Grid sizes from coarse to fine, where every grid holds all samples of the previous one
+    # at its even indices; the target resolution is snapped to the nearest size that nests
+    if levels <= 1:
+        return [resolution]
+    base = max(2, round((resolution - 1) / 2 ** (levels - 1)))
+    return [base * 2 ** level + 1 for level in range(levels)]
+
+
+def expression_parameters(settings):
+    # Free names over the z mapping and every function, in order of first appearance
+    expressions = [compile_z_function(settings['z_function'])]
+    expressions += [compile_function(func_expr) for func_expr in settings['functions'] if func_expr]
+    names = []
+    for expression in expressions:
+        names += [name for name in expression.parameters if name not in names]
+    return names
+
+
+def shared_operations(functions, backend, span_args):
+    # Report the array operations saved by evaluating shared subexpressions once
+    report = plan_report(functions, backend)
+    if report['saved_ops']:
+        logger.info("Shared subexpressions of %d functions: %d array operations instead of %d (%d saved)",
+                    report['functions'], report['planned_ops'], report['separate_ops'], report['saved_ops'])
+    span_args.update(planned_ops=report['planned_ops'], saved_ops=report['saved_ops'])
+
+
+def evaluate_grids(functions, Z, workers, is_cancelled, backend='numpy', parameters=None):
+    grids = evaluate_functions([function.source for function in functions], Z, workers, is_cancelled,
+                               backend=backend, parameters=parameters)
+    check_cancelled(is_cancelled)
+    return grids
+
+
+def mapped_grid(z_function, x, y, settings):
+    # The z grid is the same for every function and every value of their parameters,
+    # so a parameter sweep maps it only once
+    key = grid_key(z_function, settings)
+    entry = grid_cache.get(key)
+    if entry is None:
+        X, Y = np.meshgrid(x, y)
+        entry = grid_cache.put(key, dict(Z=evaluate_z(z_function, X, Y, settings['parameters'])))
+    return entry['Z']
+
+
+def evaluate_adaptive(settings, is_cancelled=None, cache=surface_cache):
+    # Each function gets its own mesh, refined where its magnitude or phase changes quickly
+    z_function = compile_z_function(settings['z_function'])
+
+    x = np.linspace(settings['x_min'], settings['x_max'], settings['resolution'])
+    y = np.linspace(settings['y_min'], settings['y_max'], settings['resolution'])
+    real_z = np.linspace(settings['x_min'], settings['x_max'], settings['resolution'])
+    Z_real = None
+    dtype = PRECISIONS[settings['precision']]
+
+    surfaces = []
+    keys = []
+    for func_expr in settings['functions']:
+        if not func_expr:
+            continue
+
+        function = compile_function(func_expr)
+        key = surface_key(function, z_function, settings, dtype) + ('adaptive', settings['point_budget'])
+        keys.append(key)
+        surface = cache.get(key)
+
+        if surface is None:
+            with span('evaluate', function=function.source, sampling='adaptive'):
+                mesh = adaptive_mesh(function, z_function, settings, is_cancelled)
+                check_cancelled(is_cancelled)
+
+                # The real line is mapped through the same Z function (with Y = 0)
+                if Z_real is None:
+                    Z_real = evaluate_z(z_function, real_z, np.zeros_like(real_z), settings['parameters'])
+                F_real = evaluate_function(function, Z_real, settings['backend'], settings['parameters'])
+
+            surface = derive_surface(mesh['F'], F_real, settings['precision'])
+            surface.update(x=mesh['x'], y=mesh['y'], i=mesh['i'], j=mesh['j'], k=mesh['k'])
+            surface = cache.put(key, surface)
+
+        surfaces.append(surface)
+
+    logger.debug("Surface cache: %s", cache.stats())
+
+    return dict(x=x, y=y, real_z=real_z, surfaces=surfaces, keys=keys)
+
+
+def evaluate_tiled(settings, is_cancelled=None, cache=surface_cache):
+    # The full grid is written to memory-mapped files, the plots get it pooled to display resolution
+    z_function = compile_z_function(settings['z_function'])
+
+    resolution, display_resolution = settings['resolution'], settings['display_resolution']
+    x = display_axis(settings['x_min'], settings['x_max'], resolution, display_resolution)
+    y = display_axis(settings['y_min'], settings['y_max'], resolution, display_resolution)
+    real_z = np.linspace(settings['x_min'], settings['x_max'], display_resolution)
+    dtype = PRECISIONS[settings['precision']]
+
+    functions = [compile_function(func_expr) for func_expr in settings['functions'] if func_expr]
+    keys = [
+        surface_key(function, z_function, settings, dtype) + ('tiled', display_resolution, settings['pooling'])
+        for function in functions
+    ]
+
+    surfaces = [cache.get(key) for key in keys]
+    missing = [index for index, surface in enumerate(surfaces) if surface is None]
+
+    if missing:
+        with span('evaluate', functions=len(missing), resolution=resolution, sampling='tiled') as span_args:
+            shared_operations([functions[index] for index in missing], settings['backend'], span_args)
+            tiles = tiled_grids([functions[index] for index in missing], z_function,
+                                [keys[index] for index in missing], settings, is_cancelled)
+            if tiles is None:
+                raise RenderCancelled()
+            logger.info("Full resolution grids written to %s", ", ".join(tiles['files']))
+
+            Z_real = evaluate_z(z_function, real_z, np.zeros_like(real_z), settings['parameters'])
+            F_reals = [evaluate_function(functions[index], Z_real, settings['backend'], settings['parameters'])
+                       for index in missing]
+
+        # The full resolution files are the persistent result here, the temporary tile
+        # directory may be gone in a later session
+        for index, F, F_real in zip(missing, tiles['grids'], F_reals):
+            surfaces[index] = cache.put(keys[index], derive_surface(F, F_real, settings['precision']), persist=False)
+
+    logger.debug("Surface cache: %s", cache.stats())
+
+    files = [tile_path(key, settings['tile_dir']) for key in keys]
+    return dict(x=x, y=y, real_z=real_z, surfaces=surfaces, keys=keys, files=files)
+
+
+def evaluate_settings(settings, is_cancelled=None, cache=surface_cache):
+    if settings['sampling'] == 'adaptive':
+        return evaluate_adaptive(settings, is_cancelled, cache)
+    if settings['sampling'] == 'tiled':
+        return evaluate_tiled(settings, is_cancelled, cache)
+
+    z_function = compile_z_function(settings['z_function'])
+
+    x = np.linspace(settings['x_min'], settings['x_max'], settings['resolution'])
+    y = np.linspace(settings['y_min'], settings['y_max'], settings['resolution'])
+    real_z = np.linspace(settings['x_min'], settings['x_max'], settings['resolution'])
+    dtype = PRECISIONS[settings['precision']]
+
+    # Skip empty input fields; compiled expressions are cached, so repeated updates skip parsing
+    functions = [compile_function(func_expr) for func_expr in settings['functions'] if func_expr]
+    keys = [surface_key(function, z_function, settings, dtype) for function in functions]
+
+    # Surfaces already evaluated for the same expression and domain are reused as is
+    surfaces = [cache.get(key) for key in keys]
+    missing = [index for index, surface in enumerate(surfaces) if surface is None]
+
+    if missing:
+        with span('evaluate', functions=len(missing), resolution=settings['resolution'], backend=settings['backend']) as span_args:
+            shared_operations([functions[index] for index in missing], settings['backend'], span_args)
+            # Dynamically generate Z based on the user's input for the Z function
+            Z = mapped_grid(z_function, x, y, settings)
+
+            # A cached grid at half the resolution already holds every other sample of this one;
+            # only for expressions that map samples one by one, the others need the whole grid
+            coarse = {}
+            resolution = settings['resolution']
+            if resolution > 2 and (resolution - 1) % 2 == 0 and z_function.elementwise:
+                coarse_settings = dict(settings, resolution=(resolution - 1) // 2 + 1)
+                for index in missing:
+                    if not functions[index].elementwise:
+                        continue
+                    surface = cache.peek(surface_key(functions[index], z_function, coarse_settings, dtype))
+                    if surface is not None:
+                        coarse[index] = surface_values(surface)
+
+            grids = {}
+
+            # Evaluate the grid for the remaining functions, across worker processes for large grids
+            full = [index for index in missing if index not in coarse]
+            if full:
+                for index, F in zip(full, evaluate_grids([functions[index] for index in full], Z, settings['workers'], is_cancelled, settings['backend'],
+                                                         settings['parameters'])):
+                    grids[index] = F
+
+            # For the refined ones only the samples between the coarse ones are evaluated
+            refine = [index for index in missing if index in coarse]
+            if refine:
+                new_points = np.ones(Z.shape, dtype=bool)
+                new_points[::2, ::2] = False
+                values = evaluate_grids([functions[index] for index in refine], Z[new_points], settings['workers'], is_cancelled,
+                                        settings['backend'], settings['parameters'])
+                for index, F_new in zip(refine, values):
+                    F = np.empty(Z.shape, dtype=np.result_type(coarse[index], F_new))
+                    F[::2, ::2] = coarse[index]
+                    F[new_points] = F_new
+                    grids[index] = F
+
+        Z_real = None
+        for index in missing:
+            row = real_axis_row(y, z_function, functions[index])
+            if row is not None:
+                # The real axis is a row of the grid (x and real_z are the same samples)
+                F_real = grids[index][row]
+            else:
+                with span('evaluate', function=functions[index].source, points=len(real_z)):
+                    # The real line is mapped through the same Z function (with Y = 0)
+                    if Z_real is None:
+                        Z_real = evaluate_z(z_function, real_z, np.zeros_like(real_z), settings['parameters'])
+                    F_real = evaluate_function(functions[index], Z_real, settings['backend'], settings['parameters'])
+            surfaces[index] = cache.put(keys[index], derive_surface(grids[index], F_real, settings['precision']))
+
+    logger.debug("Surface cache: %s", cache.stats())
+
+    return dict(x=x, y=y, real_z=real_z, surfaces=surfaces, keys=keys)
+
+
+def trace_vertex_budget(settings):
+    # Share of the per-view vertex budget of each function's trace
+    return max(1, settings['vertex_budget'] // max(1, sum(1 for func_expr in settings['functions'] if func_expr)))
+
+
+def trace_signature(key, settings):
+    # Identifies what a function's traces look like; equal signatures mean identical traces
+    return key + tuple(settings[name] for name in TRACE_SETTINGS) + (trace_vertex_budget(settings),)
+
+
+def surface_trace(surface, values, x, y, z_range, budget, mode, colorscale_settings, vertices):
+    # Uniform grids become a surface, adaptive samples a mesh over their own triangles.
+    # Only what lies within z_range is sent (see clipping); vertices counts the vertices
+    # computed and sent.
+    import plotly.graph_objects as go
+
+    if 'i' in surface:
+        z, phase, x, y, i, j, k = clip_mesh(values, surface['phase'], surface['x'], surface['y'],
+                                            surface['i'], surface['j'], surface['k'], *z_range)
+    else:
+        z, phase, x, y = clip_grid(values, surface['phase'], x, y, *z_range, budget)
+    vertices['computed'] += values.size
+    vertices['sent'] += z.size
+
+    z = encode_values(z, mode['values'])
+    phase = encode_phase(phase, mode['phase'])
+    x = encode_values(x, mode['values'])
+    y = encode_values(y, mode['values'])
+    if 'i' in surface:
+        return go.Mesh3d(x=x, y=y, z=z, i=i, j=j, k=k, intensity=phase, intensitymode='vertex', **colorscale_settings)
+    return go.Surface(z=z, x=x, y=y, surfacecolor=phase, **colorscale_settings)
+
+
+def build_figures(settings, is_cancelled=None, evaluated=None, keep=(), vertices=None):
+    # Functions whose index is in keep get an empty placeholder trace in every figure;
+    # the views still hold their traces (see render_plots).
+    # vertices, if given, receives the surface vertices computed and sent over all views.
+    # plotly is imported on the first render instead of at startup
+    import plotly.graph_objects as go
+
+    if evaluated is None:
+        evaluated = evaluate_settings(settings, is_cancelled)
+    real_z = evaluated['real_z']
+
+    # Surfaces get the 1-D axes instead of full meshgrids, and values in the transport precision
+    mode = transport_mode(settings['transport'])
+    x, y = evaluated['x'], evaluated['y']
+    cmin, cmax = phase_range(mode['phase'])
+
+    # Samples outside the z axis ranges are masked and cropped away before anything is
+    # encoded, and each view gets at most about vertex_budget vertices
+    value_range = (settings['z_min'], settings['z_max'])
+    magnitude_range = (0, settings['z_max'])
+    budget = trace_vertex_budget(settings)
+    if vertices is None:
+        vertices = {}
+    vertices.update(computed=0, sent=0)
+
+    # Initialize figures
+    fig_real_part = go.Figure()
+    fig_imaginary_part = go.Figure()
+    fig_3d = go.Figure()
+    fig_real = go.Figure()
+
+    colorscale_settings = dict(
+        colorscale=settings['colorscale'],
+        cmin=cmin,
+        cmax=cmax,
+        colorbar=dict(
+            title="Phase (π units)",
+            tickvals=encode_phase_ticks([-1, -0.5, 0, 0.5, 1], mode['phase']),
+            ticktext=["-π", "-π/2", "0", "π/2", "π"],
+            tickmode="array"
+        )
+    )
+
+    # The magnitude view can be a flat domain-colored image instead, one per function;
+    # adaptive meshes have no grid to color and stay surfaces
+    surfaces = evaluated['surfaces']
+    domain_coloring = settings['magnitude_view'] == 'domain' and not any('i' in surface for surface in surfaces)
+    if domain_coloring:
+        from plotly.subplots import make_subplots
+
+        fig_3d = make_subplots(rows=1, cols=max(len(surfaces), 1), shared_yaxes=True, horizontal_spacing=0.02)
+
+    for index, surface in enumerate(surfaces):
+        check_cancelled(is_cancelled)
+
+        if index in keep:
+            for figure in (fig_real_part, fig_imaginary_part, fig_real):
+                figure.add_trace(go.Scatter())
+            if domain_coloring:
+                fig_3d.add_trace(go.Scatter(), row=1, col=index + 1)
+            else:
+                fig_3d.add_trace(go.Scatter())
+            continue
+
+        F_real = surface['F_real']
+
+        # Real part trace
+        fig_real_part.add_trace(surface_trace(
+            surface, surface['real'], x, y, value_range, budget, mode, colorscale_settings, vertices
+        ))
+
+        # Imaginary part trace
+        fig_imaginary_part.add_trace(surface_trace(
+            surface, surface['imag'], x, y, value_range, budget, mode, colorscale_settings, vertices
+        ))
+
+        # Magnitude part trace
+        if domain_coloring:
+            fig_3d.add_trace(domain_trace(
+                surface['magnitude'], surface['phase'], evaluated['x'], evaluated['y'], settings['contours']
+            ), row=1, col=index + 1)
+        else:
+            fig_3d.add_trace(surface_trace(
+                surface, surface['magnitude'], x, y, magnitude_range, budget, mode, colorscale_settings, vertices
+            ))
+
+        # Real part of the function trace; poles become gaps in the line
+        real_values, _ = mask_range(np.real(F_real))
+        fig_real.add_trace(go.Scatter(x=real_z, y=real_values, mode='lines', line=dict(color='blue')))
+
+    if vertices['computed']:
+        logger.info("Surface vertices sent: %d of %d computed (%.0f%%)", vertices['sent'], vertices['computed'],
+                    100 * vertices['sent'] / vertices['computed'])
+
+    # Apply Z-axis limits to each plot
+    z_axis_limits = dict(range=[settings['z_min'], settings['z_max']])
+
+    fig_real_part.update_layout(
+        title="Real Part of f(z)",
+        scene=dict(
+            xaxis_title="Re(z)",
+            yaxis_title="Im(z)",
+            zaxis_title="Re(f(z))",
+            zaxis=z_axis_limits
+        ),
+        **LAYOUT_SETTINGS
+    )
+
+    fig_imaginary_part.update_layout(
+        title="Imaginary Part of f(z)",
+        scene=dict(
+            xaxis_title="Re(z)",
+            yaxis_title="Im(z)",
+            zaxis_title="Im(f(z))",
+            zaxis=z_axis_limits
+        ),
+        **LAYOUT_SETTINGS
+    )
+
+    if domain_coloring:
+        # Upright y axis (images default to a reversed one), and square pixels
+        fig_3d.update_xaxes(title_text="Re(z)", constrain='domain')
+        fig_3d.update_yaxes(autorange=True, constrain='domain')
+        fig_3d.update_yaxes(title_text="Im(z)", scaleanchor='x', row=1, col=1)
+        fig_3d.update_layout(title="Domain Coloring of f(z)", **LAYOUT_SETTINGS)
+    else:
+        fig_3d.update_layout(
+            title="Magnitude of f(z)",
+            scene=dict(
+                xaxis_title="Re(z)",
+                yaxis_title="Im(z)",
+                zaxis_title="|f(z)|",
+                zaxis=dict(range=[0, settings['z_max']])
+            ),
+            **LAYOUT_SETTINGS
+        )
+
+    fig_real.update_layout(
+        title="Real Function f(z)",
+        scene=dict(
+            xaxis_title="z",
+            yaxis_title="f(z)",
+        ),
+        **LAYOUT_SETTINGS
+    )
+
+    return dict(
+        magnitude=fig_3d,
+        imaginary_part=fig_imaginary_part,
+        real_part=fig_real_part,
+        real_function=fig_real
+    )
+
+
+def render_plots(settings, is_cancelled=None, final=None, vertices=None):
+    # Evaluate, build and serialize all four plots. Returns the figure JSON bytes of each view
+    # and the signature of every function's traces; vertices receives the vertex counts of
+    # build_figures.
+    # A function whose traces the views already show (settings['displayed']) is not built or sent
+    # again, its traces are only referenced; so is one that shows the final signature of a
+    # progressive render while a coarser pass is drawn.
+    evaluated = evaluate_settings(settings, is_cancelled)
+    signatures = [trace_signature(key, settings) for key in evaluated['keys']]
+    displayed = settings['displayed']
+
+    keep = set()
+    for index, signature in enumerate(signatures):
+        if index < len(displayed) and displayed[index] is not None and displayed[index] in (signature, (final or {}).get(index)):
+            keep.add(index)
+            signatures[index] = displayed[index]
+
+    if vertices is None:
+        vertices = {}
+    with span('build_figures', resolution=settings['resolution'], kept=len(keep)) as span_args:
+        figures = build_figures(settings, is_cancelled, evaluated, keep, vertices)
+        span_args.update(vertices_computed=vertices['computed'], vertices_sent=vertices['sent'])
+
+    payloads = {}
+    with span('serialize', transport=settings['transport']):
+        for name in VIEW_NAMES:
+            check_cancelled(is_cancelled)
+            # Encoded here, so the UI thread only hands the bytes to the web view
+            payloads[name] = figure_to_json(figures[name], keep).encode('utf-8')
+
+    logger.debug("Payload bytes: %d", sum(len(payload) for payload in payloads.values()))
+
+    return payloads, signatures
+
+
+def final_signatures(settings):
+    # Trace signatures of the uniform or tiled grids at the target resolution, by function index
+    z_function = compile_z_function(settings['z_function'])
+    dtype = PRECISIONS[settings['precision']]
+    functions = [compile_function(func_expr) for func_expr in settings['functions'] if func_expr]
+    # The same keys as evaluate_settings and evaluate_tiled
+    suffix = ('tiled', settings['display_resolution'], settings['pooling']) if settings['sampling'] == 'tiled' else ()
+    return {
+        index: trace_signature(surface_key(function, z_function, settings, dtype) + suffix, settings)
+        for index, function in enumerate(functions)
+    }
+
+
+def cached(settings, cache=surface_cache):
+    # Whether every function's uniform grid for these settings is already cached
+    z_function = compile_z_function(settings['z_function'])
+    dtype = PRECISIONS[settings['precision']]
+    return all(
+        cache.peek(surface_key(compile_function(func_expr), z_function, settings, dtype)) is not None
+        for func_expr in settings['functions'] if func_expr
+    )
+
+
+def render_passes(settings, is_cached=cached):
+    # Settings of each pass of a progressive render, from coarse to the target
+    if settings['sampling'] == 'adaptive' or (settings['sampling'] == 'uniform' and is_cached(settings)):
+        # Adaptive meshes refine themselves, and cached grids (e.g. sweep frames) need no
+        # preview; both are rendered in a single pass
+        return [settings]
+    if settings['sampling'] == 'tiled':
+        # A uniform grid at display resolution is shown while the full grid is computed in tiles
+        return [dict(settings, sampling='uniform', resolution=settings['display_resolution']), settings]
+    return [
+        dict(settings, resolution=resolution)
+        for resolution in refinement_levels(settings['resolution'], settings['levels'])
+    ]
+
+
+def render_progressive(settings, is_cancelled=None):
+    # Render a coarse preview first, then each finer level up to the target resolution.
+    # Every level reuses the cached samples of the one before, and stops once cancelled.
+    passes = render_passes(settings)
+
+    # Traces already drawn at the target resolution are kept through the coarse passes
+    final = final_signatures(passes[-1]) if settings['sampling'] in ('uniform', 'tiled') else None
+    displayed = list(settings['displayed'])
+    for level, pass_settings in enumerate(passes, start=1):
+        check_cancelled(is_cancelled)
+        vertices = {}
+        with tracer.collect() as timings:
+            payloads, signatures = render_plots(dict(pass_settings, displayed=displayed), is_cancelled, final, vertices)
+        # A trace an earlier pass replaced is no longer the displayed one, it is sent again
+        # by every later pass instead of being kept
+        displayed = [
+            signature if index < len(signatures) and signatures[index] == signature else None
+            for index, signature in enumerate(displayed)
+        ]
+        yield dict(payloads=payloads, signatures=signatures, resolution=pass_settings['resolution'], level=level,
+                   levels=len(passes), timings=timings, vertices=vertices)
+
+
+def render_sweep(settings, is_cancelled=None):
+    # Precompute the surfaces for every value of one parameter, settings['sweep'] = (name, values).
+    # The frames land in the surface cache, so scrubbing or playing through them only rebuilds
+    # the figures; the z grid and the compiled expressions are shared by all of them.
+    # Yields the progress after each frame.
+    name, values = settings['sweep']
+    for done, value in enumerate(values, start=1):
+        check_cancelled(is_cancelled)
+        frame = dict(settings, parameters=dict(settings['parameters'], **{name: value}))
+        with tracer.collect() as timings:
+            evaluate_settings(frame, is_cancelled)
+        yield dict(sweep=name, value=value, done=done, total=len(values), timings=timings)
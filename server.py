@@ -0,0 +1,540 @@
+# Web server mode: the plots in a browser, evaluated on this machine for any number of clients.
+#
+#   python server.py --host 0.0.0.0 --port 8050 --workers 4
+#
+# Serves one page and plotly.js from the local plotly package, so it works offline, plus a
+# WebSocket at /ws. A client sends {"id": ..., "settings": {make_settings arguments}} and gets one
+# binary message per refinement pass (see transport.pack_message), or a JSON {"id", "error"}.
+# POST /render with the settings JSON returns the final pass as one binary message, and
+# GET /stats the cache and pool counters.
+#
+# Evaluation runs in a bounded process pool, so the event loop never blocks. Identical passes
+# requested while one is being computed wait for that computation instead of starting another,
+# and finished passes are kept in an LRU cache shared by all clients. The workers also share
+# the disk store of evaluated surfaces (cache.DiskStore) with each other and with the app.
+import argparse
+import ast
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import struct
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from assets import SERVER_PAGE
+from backends import BACKENDS
+from cache import open_store, surface_cache
+from domain import MAGNITUDE_VIEWS
+from expression import SAFE_FUNCTIONS, compile_function, compile_z_function
+from plotting import PRECISIONS, SAMPLING_MODES, build_figures, evaluate_settings, make_settings, render_passes
+from tiled import POOLING_MODES, TILE_DIR
+from tracing import configure_logging, span, tracer
+from transport import TRANSPORT_MODES, figures_to_binary, pack_message
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8050
+
+# Finished passes kept for all clients
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Seconds one pass may take; the worker stops it, and a worker stuck in a single numpy call
+# is given up on after the grace period
+DEFAULT_PASS_TIMEOUT = 60
+TIMEOUT_GRACE = 5
+
+# Limits on what one client may ask for
+MAX_RESOLUTION = 2000
+MAX_FUNCTIONS = 8
+# Refinement levels, the range the app offers
+MAX_LEVELS = 5
+MAX_REQUEST_BYTES = 1024 * 1024
+# Largest exponent (or shift) of a constant in a client expression; Python integers grow without bound
+MAX_EXPONENT = 64
+
+# make_settings arguments a client may set, and the allowed values of the ones that are choices
+CLIENT_SETTINGS = (
+    'z_function', 'functions', 'colorscale', 'transport', 'resolution', 'levels', 'sampling', 'point_budget',
+    'backend', 'display_resolution', 'pooling', 'magnitude_view', 'contours', 'precision', 'parameters',
+    'vertex_budget', 'x_min', 'x_max', 'y_min', 'y_max', 'z_min', 'z_max'
+)
+CHOICES = dict(
+    transport=TRANSPORT_MODES, sampling=SAMPLING_MODES, backend=BACKENDS, pooling=POOLING_MODES,
+    magnitude_view=MAGNITUDE_VIEWS, precision=PRECISIONS
+)
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OPCODE_CONTINUATION, OPCODE_TEXT, OPCODE_BINARY = 0x0, 0x1, 0x2
+OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG = 0x8, 0x9, 0xA
+
+
+def _init_worker(log_level, cache_dir):
+    configure_logging(log_level)
+    # Requests already run in parallel across processes, so numexpr stays single threaded in each
+    os.environ['NUMEXPR_NUM_THREADS'] = '1'
+    surface_cache.store = open_store(cache_dir)
+
+
+def _pass_timed_out(signum, frame):
+    raise TimeoutError("Render timed out")
+
+
+def render_pass(settings, timeout=None):
+    # Runs in a worker process: one pass as the body of a binary message, its stage timings
+    # and the surface vertices computed and sent. Tasks run on the worker's main thread, so an
+    # interval timer can interrupt a pass that takes longer than timeout seconds.
+    timer = timeout and hasattr(signal, 'setitimer')
+    if timer:
+        signal.signal(signal.SIGALRM, _pass_timed_out)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        vertices = {}
+        with tracer.collect() as timings:
+            evaluated = evaluate_settings(settings)
+            with span('build_figures', resolution=settings['resolution']):
+                figures = build_figures(settings, evaluated=evaluated, vertices=vertices)
+            with span('serialize', transport=settings['transport'], format='binary'):
+                document, data = figures_to_binary(figures)
+    finally:
+        if timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return document, data, timings, vertices
+
+
+def client_settings(options, tile_dir):
+    # Settings of a client request, checked before anything is evaluated
+    if not isinstance(options, dict):
+        raise ValueError("settings must be an object")
+    unknown = set(options) - set(CLIENT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    for name, choices in CHOICES.items():
+        if name in options and options[name] not in choices:
+            raise ValueError(f"{name} must be one of {', '.join(choices)}")
+
+    functions = options.get('functions', [])
+    if not isinstance(functions, list) or not all(isinstance(text, str) for text in functions):
+        raise ValueError("functions must be a list of expressions")
+    if len(functions) > MAX_FUNCTIONS:
+        raise ValueError(f"At most {MAX_FUNCTIONS} functions")
+
+    settings = make_settings(workers=1, tile_dir=tile_dir, **options)
+    for name in ('resolution', 'display_resolution', 'levels', 'point_budget', 'vertex_budget'):
+        if not isinstance(settings[name], int) or settings[name] < 1:
+            raise ValueError(f"{name} must be a positive integer")
+    if max(settings['resolution'], settings['display_resolution']) > MAX_RESOLUTION:
+        raise ValueError(f"Resolution is limited to {MAX_RESOLUTION}")
+    if settings['levels'] > MAX_LEVELS:
+        raise ValueError(f"At most {MAX_LEVELS} levels")
+
+    # Parse errors are reported right away, without taking a worker
+    check_client_expression(compile_z_function(settings['z_function']))
+    for text in settings['functions']:
+        if text:
+            check_client_expression(compile_function(text))
+    return settings
+
+
+def check_client_expression(compiled):
+    # Expressions from remote clients may only use the numeric parts of numpy, and may not
+    # build huge integers or sequences before any grid is involved
+    tree = ast.parse(compiled.key, mode='eval')
+    numpy_attributes = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'np':
+            numpy_attributes.add(id(node.value))
+            if not isinstance(getattr(np, node.attr), (np.ufunc, float)):
+                raise ValueError(f"np.{node.attr} is not allowed in {compiled.source!r}")
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == 'np' and id(node) not in numpy_attributes:
+            raise ValueError(f"np is not allowed in {compiled.source!r}")
+        if not isinstance(node, ast.BinOp):
+            continue
+        if any(isinstance(operand, (ast.List, ast.Tuple)) for operand in (node.left, node.right)):
+            raise ValueError(f"Arithmetic on sequences is not allowed in {compiled.source!r}")
+        # Powers of arrays are bounded by their size; powers of plain numbers are not
+        if isinstance(node.op, (ast.Pow, ast.LShift)) and _is_constant(node.left):
+            base, exponent = _literal(node.left), _literal(node.right)
+            if base is None or (exponent is None and _is_constant(node.right)):
+                raise ValueError(f"Powers of constants must be of plain numbers in {compiled.source!r}")
+            if exponent is not None and abs(exponent) > MAX_EXPONENT:
+                raise ValueError(f"Constant exponents are limited to {MAX_EXPONENT} in {compiled.source!r}")
+
+
+def _literal(node):
+    # The number a (signed) literal or named constant stands for, otherwise None
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        node = node.operand
+    if isinstance(node, ast.Name) and node.id in ('pi', 'e'):
+        return SAFE_FUNCTIONS[node.id]
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, complex)):
+        return node.value
+    return None
+
+
+def _is_constant(node):
+    # No variable or parameter in it, so Python evaluates it on plain numbers
+    return not any(isinstance(child, ast.Name) and child.id not in ('pi', 'e') for child in ast.walk(node))
+
+
+def client_passes(settings, is_cached):
+    # The passes of a request; snapping to nested grids can take the target past the limit
+    passes = render_passes(settings, is_cached)
+    if any(pass_settings['resolution'] > MAX_RESOLUTION for pass_settings in passes):
+        raise ValueError(f"Resolution is limited to {MAX_RESOLUTION}")
+    return passes
+
+
+def pass_key(settings):
+    # Identical for passes that render the same figures; expressions in canonical form
+    functions = [compile_function(text).key for text in settings['functions'] if text]
+    rest = {name: value for name, value in settings.items()
+            if name not in ('z_function', 'functions', 'workers', 'displayed', 'tile_dir')}
+    return json.dumps([compile_z_function(settings['z_function']).key, functions, rest], sort_keys=True)
+
+
+class PassCache:
+    # LRU cache of finished passes (document, data, timings, vertices), bounded by their size in bytes
+
+    def __init__(self, budget_bytes=DEFAULT_CACHE_BYTES):
+        self.budget_bytes = budget_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        size = len(entry[0]) + len(entry[1])
+        if size > self.budget_bytes or key in self.entries:
+            return
+        self.entries[key] = entry
+        self.total_bytes += size
+        while self.total_bytes > self.budget_bytes:
+            _, (document, data, _, _) = self.entries.popitem(last=False)
+            self.total_bytes -= len(document) + len(data)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+
+class RenderService:
+    # Hands passes to the process pool; every distinct pass is computed at most once at a time.
+    # Lives on the event loop thread, so its state needs no locking.
+
+    def __init__(self, executor, max_pending, cache_bytes=DEFAULT_CACHE_BYTES, timeout=DEFAULT_PASS_TIMEOUT):
+        self.executor = executor
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(max_pending)
+        self.cache = PassCache(cache_bytes)
+        self.in_flight = {}
+        self.counters = dict(computed=0, coalesced=0, cached=0, failed=0)
+
+    def is_cached(self, settings):
+        return pass_key(settings) in self.cache
+
+    async def render(self, settings):
+        # (document, data, timings, vertices, source), where source tells how the request was served
+        key = pass_key(settings)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.counters['cached'] += 1
+            return entry + ('cache',)
+
+        task = self.in_flight.get(key)
+        source = 'shared'
+        if task is None:
+            task = asyncio.ensure_future(self.compute(key, settings))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+            source = 'computed'
+        else:
+            self.counters['coalesced'] += 1
+
+        # A client that goes away must not cancel a computation others are waiting for;
+        # a failed computation raises its error in every request that waits for it
+        return await asyncio.shield(task) + (source,)
+
+    async def compute(self, key, settings):
+        async with self.slots:
+            try:
+                future = asyncio.get_running_loop().run_in_executor(self.executor, render_pass, settings, self.timeout)
+                entry = await asyncio.wait_for(future, self.timeout + TIMEOUT_GRACE if self.timeout else None)
+            except asyncio.TimeoutError:
+                self.counters['failed'] += 1
+                raise TimeoutError("Render timed out") from None
+            except Exception:
+                self.counters['failed'] += 1
+                raise
+        self.counters['computed'] += 1
+        self.cache.put(key, entry)
+        return entry
+
+    def stats(self):
+        return dict(self.counters, in_flight=len(self.in_flight), cached_passes=len(self.cache.entries),
+                    cache_bytes=self.cache.total_bytes, cache_budget_bytes=self.cache.budget_bytes)
+
+
+class WebSocket:
+    # Server side of RFC 6455 on asyncio streams: whole messages in, single frames out
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.send_lock = asyncio.Lock()
+
+    async def receive(self):
+        # The next text or binary message, or None once the connection is closed
+        message = bytearray()
+        message_opcode = None
+        while True:
+            first, second = await self.reader.readexactly(2)
+            fin, opcode = first & 0x80, first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length, = struct.unpack('>H', await self.reader.readexactly(2))
+            elif length == 127:
+                length, = struct.unpack('>Q', await self.reader.readexactly(8))
+            if not second & 0x80:
+                # Clients must mask their frames
+                await self.close(1002)
+                return None
+            if len(message) + length > MAX_REQUEST_BYTES:
+                await self.close(1009)
+                return None
+
+            mask = np.frombuffer(await self.reader.readexactly(4), dtype=np.uint8)
+            payload = np.frombuffer(await self.reader.readexactly(length), dtype=np.uint8)
+            payload = (payload ^ np.resize(mask, length)).tobytes()
+
+            if opcode == OPCODE_CLOSE:
+                await self.close(1000)
+                return None
+            if opcode == OPCODE_PING:
+                await self.send(payload, OPCODE_PONG)
+                continue
+            if opcode == OPCODE_PONG:
+                continue
+
+            if opcode != OPCODE_CONTINUATION:
+                message_opcode = opcode
+            message += payload
+            if fin:
+                return bytes(message) if message_opcode == OPCODE_BINARY else message.decode('utf-8')
+
+    async def send(self, data, opcode=OPCODE_BINARY):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+            opcode = OPCODE_TEXT
+        length = len(data)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        async with self.send_lock:
+            self.writer.write(header)
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def close(self, code):
+        try:
+            await self.send(struct.pack('>H', code), OPCODE_CLOSE)
+        except ConnectionError:
+            pass
+
+
+class Server:
+    def __init__(self, service, tile_dir):
+        self.service = service
+        self.tile_dir = tile_dir
+        self.plotly_js = None
+
+    def load_assets(self):
+        from plotly.offline import get_plotlyjs
+
+        self.plotly_js = get_plotlyjs().encode('utf-8')
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, headers, body = await read_request(reader)
+            if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                await self.serve_websocket(reader, writer, headers)
+            elif method == 'GET' and path in ('/', '/index.html'):
+                await respond(writer, 200, 'text/html; charset=utf-8', SERVER_PAGE.encode('utf-8'))
+            elif method == 'GET' and path == '/plotly.min.js':
+                await respond(writer, 200, 'application/javascript', self.plotly_js,
+                              {'Cache-Control': 'max-age=86400'})
+            elif method == 'GET' and path == '/stats':
+                await respond(writer, 200, 'application/json', json.dumps(self.service.stats()).encode('utf-8'))
+            elif method == 'POST' and path == '/render':
+                await self.serve_render(writer, body)
+            else:
+                await respond(writer, 404, 'text/plain', b"Not found")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except ValueError as e:
+            await respond(writer, 400, 'text/plain', str(e).encode('utf-8'))
+        except Exception:
+            logger.exception("Request failed")
+            await respond(writer, 500, 'application/json', json.dumps(dict(error="Internal error")).encode('utf-8'))
+        finally:
+            writer.close()
+
+    async def serve_render(self, writer, body):
+        try:
+            settings = client_settings(json.loads(body or b'{}'), self.tile_dir)
+            document, data, timings, vertices, source = await self.service.render(settings)
+        except (ValueError, TypeError) as e:
+            await respond(writer, 400, 'application/json', json.dumps(dict(error=str(e))).encode('utf-8'))
+            return
+        except TimeoutError as e:
+            await respond(writer, 504, 'application/json', json.dumps(dict(error=str(e))).encode('utf-8'))
+            return
+        except Exception as e:
+            logger.exception("Render failed")
+            await respond(writer, 500, 'application/json',
+                          json.dumps(dict(error=f"{type(e).__name__}: {e}")).encode('utf-8'))
+            return
+        meta = dict(level=1, levels=1, resolution=settings['resolution'], timings=timings, vertices=vertices,
+                    source=source)
+        await respond(writer, 200, 'application/octet-stream', pack_message(meta, document, data))
+
+    async def serve_websocket(self, reader, writer, headers):
+        key = headers.get('sec-websocket-key', '')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+        writer.write(
+            b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            + f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode('ascii')
+        )
+        await writer.drain()
+
+        socket = WebSocket(reader, writer)
+        current = None
+        try:
+            while True:
+                message = await socket.receive()
+                if message is None:
+                    break
+                # A newer request from the same client replaces the one it is still waiting for
+                if current is not None:
+                    current.cancel()
+                current = asyncio.ensure_future(self.stream(socket, message))
+        finally:
+            if current is not None:
+                current.cancel()
+
+    async def stream(self, socket, message):
+        # Send every pass of one request as soon as it is ready
+        request_id = None
+        try:
+            request = json.loads(message)
+            request_id = request.get('id')
+            settings = client_settings(request.get('settings', {}), self.tile_dir)
+            passes = client_passes(settings, self.service.is_cached)
+            for level, pass_settings in enumerate(passes, start=1):
+                document, data, timings, vertices, source = await self.service.render(pass_settings)
+                meta = dict(id=request_id, level=level, levels=len(passes), resolution=pass_settings['resolution'],
+                            timings=timings, vertices=vertices, source=source)
+                await socket.send(pack_message(meta, document, data))
+        except asyncio.CancelledError:
+            raise
+        except ConnectionError:
+            pass
+        except Exception as e:
+            if not isinstance(e, (ValueError, TypeError, AttributeError, TimeoutError)):
+                logger.exception("Render failed")
+            try:
+                await socket.send(json.dumps(dict(id=request_id, error=str(e))))
+            except ConnectionError:
+                pass
+
+
+async def read_request(reader):
+    # Request line and headers of one HTTP/1.1 request, and its body if it has one
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, _ = lines[0].split(' ', 2)
+    except ValueError:
+        raise ValueError("Malformed request line") from None
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0) or 0)
+    if length > MAX_REQUEST_BYTES:
+        raise ValueError("Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method, target.split('?', 1)[0], headers, body
+
+
+async def respond(writer, status, content_type, body, headers=None):
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error', 504: 'Gateway Timeout'}
+    lines = [f"HTTP/1.1 {status} {reasons.get(status, '')}", f"Content-Type: {content_type}",
+             f"Content-Length: {len(body)}", "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+    writer.write(body)
+    await writer.drain()
+
+
+async def serve(args, executor):
+    service = RenderService(executor, args.max_pending or 2 * args.workers, args.cache_mb * 1024 * 1024,
+                            args.pass_timeout or None)
+    server = Server(service, args.tile_dir)
+    server.load_assets()
+
+    listener = await asyncio.start_server(server.handle, args.host, args.port)
+    addresses = ", ".join(f"http://{sock.getsockname()[0]}:{sock.getsockname()[1]}" for sock in listener.sockets)
+    print(f"Serving on {addresses}", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the complex function plots to browsers.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (0.0.0.0 for every interface)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="evaluation processes")
+    parser.add_argument('--max-pending', type=int, default=None, help="passes in flight (default: 2 per worker)")
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help="memory for finished passes shared by all clients")
+    parser.add_argument('--cache-dir', default=None,
+                        help="disk store of evaluated surfaces (default: COMPLEX_PLOT_CACHE_DIR or ~/.cache/complexplot)")
+    parser.add_argument('--pass-timeout', type=float, default=DEFAULT_PASS_TIMEOUT,
+                        help="seconds one refinement pass may take (0 for no limit)")
+    parser.add_argument('--tile-dir', default=TILE_DIR, help="full resolution grids of tiled requests")
+    parser.add_argument('--log-level', default=None, choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help="logging written to stderr (default: COMPLEX_PLOT_LOG_LEVEL or WARNING)")
+    args = parser.parse_args(argv)
+    log_level = configure_logging(args.log_level)
+
+    context = multiprocessing.get_context('spawn')
+    executor = ProcessPoolExecutor(max_workers=max(args.workers, 1), mp_context=context,
+                                   initializer=_init_worker, initargs=(log_level, args.cache_dir))
+    try:
+        asyncio.run(serve(args, executor))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
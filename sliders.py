@@ -0,0 +1,94 @@
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import QGridLayout, QLabel, QLineEdit, QPushButton, QSlider, QWidget
+
+from expression import DEFAULT_PARAMETER_VALUE
+
+# Positions of a parameter slider; a sweep precomputes one frame per position
+PARAMETER_STEPS = 40
+
+# Slider range of a newly found parameter
+DEFAULT_PARAMETER_RANGE = (-2.0, 2.0)
+
+
+def parameter_steps(minimum, maximum, steps=PARAMETER_STEPS):
+    # Values of every slider position. The slider and the sweep both take their values from
+    # here, so a scrubbed value hits exactly the cache entry its sweep frame was stored under.
+    return [round(minimum + (maximum - minimum) * position / steps, 12) for position in range(steps + 1)]
+
+
+class ParameterSlider(QWidget):
+    # One row per parameter: name, slider, current value, range, and sweep / play buttons
+
+    value_changed = pyqtSignal(str)
+    sweep_requested = pyqtSignal(str)
+    play_toggled = pyqtSignal(str, bool)
+
+    def __init__(self, name, parent=None):
+        super().__init__(parent)
+        self.name = name
+
+        layout = QGridLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        self.slider = QSlider(Qt.Horizontal, self)
+        self.slider.setRange(0, PARAMETER_STEPS)
+        self.value_label = QLabel(self)
+        self.value_label.setMinimumWidth(40)
+
+        self.min_input = QLineEdit(str(DEFAULT_PARAMETER_RANGE[0]), self)
+        self.max_input = QLineEdit(str(DEFAULT_PARAMETER_RANGE[1]), self)
+
+        self.sweep_button = QPushButton("Sweep", self)
+        self.play_button = QPushButton("Play", self)
+        self.play_button.setCheckable(True)
+
+        layout.addWidget(QLabel(f"{name}:", self), 0, 0)
+        layout.addWidget(self.slider, 0, 1, 1, 2)
+        layout.addWidget(self.value_label, 0, 3)
+        layout.addWidget(self.min_input, 1, 0, 1, 2)
+        layout.addWidget(self.max_input, 1, 2, 1, 2)
+        layout.addWidget(self.sweep_button, 2, 0, 1, 2)
+        layout.addWidget(self.play_button, 2, 2, 1, 2)
+
+        # Start at the value the parameter had before it got a slider
+        self.set_value(DEFAULT_PARAMETER_VALUE)
+
+        self.slider.valueChanged.connect(self.on_slider_moved)
+        self.min_input.editingFinished.connect(self.on_range_changed)
+        self.max_input.editingFinished.connect(self.on_range_changed)
+        self.sweep_button.clicked.connect(lambda: self.sweep_requested.emit(self.name))
+        self.play_button.toggled.connect(lambda playing: self.play_toggled.emit(self.name, playing))
+
+    def value_range(self):
+        try:
+            minimum, maximum = float(self.min_input.text()), float(self.max_input.text())
+        except ValueError:
+            return DEFAULT_PARAMETER_RANGE
+        return (minimum, maximum) if minimum != maximum else DEFAULT_PARAMETER_RANGE
+
+    def values(self):
+        return parameter_steps(*self.value_range())
+
+    def value(self):
+        return self.values()[self.slider.value()]
+
+    def set_value(self, value):
+        # Move to the nearest position without emitting value_changed
+        values = self.values()
+        position = min(range(len(values)), key=lambda index: abs(values[index] - value))
+        self.slider.blockSignals(True)
+        self.slider.setValue(position)
+        self.slider.blockSignals(False)
+        self.value_label.setText(f"{self.value():g}")
+
+    def step(self):
+        # Next position, wrapping around at the end for playback
+        self.slider.setValue((self.slider.value() + 1) % (PARAMETER_STEPS + 1))
+
+    def on_slider_moved(self):
+        self.value_label.setText(f"{self.value():g}")
+        self.value_changed.emit(self.name)
+
+    def on_range_changed(self):
+        self.value_label.setText(f"{self.value():g}")
+        self.value_changed.emit(self.name)
@@ -0,0 +1,165 @@
+import hashlib
+import math
+import os
+import tempfile
+import time
+import uuid
+import warnings
+
+import numpy as np
+
+from expression import evaluate_z
+from parallel import evaluate_functions
+
+# Samples evaluated per tile over all functions; peak memory follows this, not the grid size
+TILE_SAMPLES = 1_000_000
+
+# Size of the pooled grid that is plotted, and how each block of samples is reduced to one
+DEFAULT_DISPLAY_RESOLUTION = 200
+POOLING_MODES = ('max', 'mean')
+
+# Full resolution results are written here, one <hash>.npy per function and domain
+TILE_DIR = os.path.join(tempfile.gettempdir(), 'complexplot-tiles')
+
+# Size the tile directory is kept under; the least recently written files are removed first
+TILE_DIR_BYTES = 2 * 1024 * 1024 * 1024
+
+# Partly written files older than this are left over from a crashed run
+STALE_TEMP_SECONDS = 3600
+
+
+def pool_factor(resolution, display_resolution):
+    return max(1, math.ceil(resolution / max(display_resolution, 1)))
+
+
+def pool(block, factor, mode='mean'):
+    # Reduce every factor x factor block to one value; the last row and column of blocks
+    # may be partial, they are padded with nan which both modes skip
+    rows, cols = block.shape
+    out_rows, out_cols = -(-rows // factor), -(-cols // factor)
+    padded = np.full((out_rows * factor, out_cols * factor), np.nan, dtype=np.result_type(block, float))
+    padded[:rows, :cols] = block
+    blocks = padded.reshape(out_rows, factor, out_cols, factor).swapaxes(1, 2).reshape(out_rows, out_cols, -1)
+
+    if mode == 'mean':
+        with warnings.catch_warnings():
+            # Blocks that are nan throughout stay nan
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmean(blocks, axis=-1)
+
+    # max: the sample of largest magnitude, so poles and narrow spikes survive the downsampling
+    magnitude = np.abs(blocks)
+    magnitude[np.isnan(magnitude)] = -1
+    index = magnitude.argmax(axis=-1)
+    return np.take_along_axis(blocks, index[..., None], axis=-1)[..., 0]
+
+
+def display_axis(start, stop, resolution, display_resolution):
+    # Centres of the pooled blocks along one axis
+    axis = np.linspace(start, stop, resolution)
+    return pool(axis[None, :], pool_factor(resolution, display_resolution))[0]
+
+
+def tile_path(key, tile_dir=TILE_DIR):
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20]
+    return os.path.join(tile_dir, f"{digest}.npy")
+
+
+def evict_tiles(tile_dir, budget_bytes=None, keep=()):
+    # Remove the oldest results until the directory fits budget_bytes, except the ones in keep,
+    # along with stale partly written files. Other processes may be removing files too.
+    # Returns the number of files removed.
+    budget_bytes = TILE_DIR_BYTES if budget_bytes is None else budget_bytes
+    files = []
+    removed = 0
+    for entry in os.scandir(tile_dir):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if entry.name.endswith('.tmp'):
+            if time.time() - stat.st_mtime > STALE_TEMP_SECONDS:
+                removed += _remove(entry.path)
+        elif entry.name.endswith('.npy'):
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= budget_bytes:
+            break
+        if path not in keep:
+            removed += _remove(path)
+            total -= size
+    return removed
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+def tiled_grids(functions, z_function, keys, settings, is_cancelled=None):
+    # Evaluate the functions over the full grid one block of rows at a time. Each block goes
+    # into a memory-mapped .npy per function and is pooled to display resolution right away,
+    # so only one block and the small display grids are ever held in memory. Each file is
+    # written under a name of its own and only renamed to its key's path once complete, so
+    # concurrent runs for the same key never see or remove each other's files.
+    # Returns None if cancelled, the partly written files are removed then.
+    resolution = settings['resolution']
+    factor = pool_factor(resolution, settings['display_resolution'])
+    tile_rows = max(factor, TILE_SAMPLES // max(resolution * len(functions), 1) // factor * factor)
+
+    x = np.linspace(settings['x_min'], settings['x_max'], resolution)
+    y = np.linspace(settings['y_min'], settings['y_max'], resolution)
+
+    tile_dir = settings['tile_dir']
+    os.makedirs(tile_dir, exist_ok=True)
+    paths = [tile_path(key, tile_dir) for key in keys]
+    temp_paths = [f"{path}.{uuid.uuid4().hex}.tmp" for path in paths]
+    outputs = [
+        np.lib.format.open_memmap(path, mode='w+', dtype=complex, shape=(resolution, resolution))
+        for path in temp_paths
+    ]
+    pooled = [[] for _ in functions]
+    completed = False
+
+    try:
+        for start in range(0, resolution, tile_rows):
+            if is_cancelled is not None and is_cancelled():
+                return None
+
+            X, Y = np.meshgrid(x, y[start:start + tile_rows])
+            Z = evaluate_z(z_function, X, Y, settings['parameters'])
+            del X, Y
+
+            grids = evaluate_functions([function.source for function in functions], Z, settings['workers'],
+                                       is_cancelled, backend=settings['backend'], parameters=settings['parameters'])
+            if grids is None:
+                return None
+
+            for output, blocks, F in zip(outputs, pooled, grids):
+                output[start:start + len(F)] = F
+                blocks.append(pool(F, factor, settings['pooling']))
+            del Z, grids
+        completed = True
+
+    finally:
+        for output in outputs:
+            output.flush()
+        # The maps are closed before the files are renamed or removed
+        outputs = output = None
+        if completed:
+            for temp_path, path in zip(temp_paths, paths):
+                os.replace(temp_path, path)
+        else:
+            for temp_path in temp_paths:
+                _remove(temp_path)
+
+    # Only the shared temporary directory is capped; a directory the caller chose, such as a
+    # batch run's output, keeps every result it asked for
+    if os.path.abspath(tile_dir) == os.path.abspath(TILE_DIR):
+        evict_tiles(tile_dir, keep=paths)
+    return dict(grids=[np.concatenate(blocks) for blocks in pooled], files=paths)
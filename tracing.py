@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Most recent spans kept for export; older ones are dropped
+MAX_EVENTS = 20000
+
+# Log level used when none is given, overridden by COMPLEX_PLOT_LOG_LEVEL
+DEFAULT_LOG_LEVEL = 'WARNING'
+
+# Stage names, in pipeline order
+STAGES = ('parse', 'evaluate', 'derive', 'build_figures', 'serialize', 'page_load', 'redraw')
+
+
+class Tracer:
+    # Records named spans and exports them in the Chrome trace event format
+    # (load the file in chrome://tracing or https://ui.perfetto.dev)
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self.events = deque(maxlen=max_events)
+        self.thread_names = {}
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def now_us(self):
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def add(self, name, start_us, duration_us, **args):
+        thread = threading.current_thread()
+        event = dict(name=name, cat='render', ph='X', ts=start_us, dur=duration_us,
+                     pid=os.getpid(), tid=thread.ident, args=args)
+        with self.lock:
+            self.events.append(event)
+            self.thread_names[thread.ident] = thread.name
+
+        # Totals per stage for whoever is collecting on this thread (see collect)
+        totals = getattr(self.local, 'totals', None)
+        if totals is not None:
+            totals[name] = totals.get(name, 0.0) + duration_us / 1000
+
+    @contextmanager
+    def span(self, name, **args):
+        # Yields the span's arguments, so details known only at the end can be added
+        start = self.now_us()
+        try:
+            yield args
+        finally:
+            self.add(name, start, self.now_us() - start, **args)
+
+    @contextmanager
+    def collect(self):
+        # Sum the milliseconds spent per stage by spans on this thread while active
+        previous = getattr(self.local, 'totals', None)
+        totals = {}
+        self.local.totals = totals
+        try:
+            yield totals
+        finally:
+            self.local.totals = previous
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+
+    def export(self, path):
+        with self.lock:
+            events = list(self.events)
+            names = [
+                dict(name='thread_name', ph='M', pid=os.getpid(), tid=ident, args=dict(name=name))
+                for ident, name in self.thread_names.items()
+            ]
+        with open(path, 'w') as f:
+            json.dump(dict(traceEvents=names + events, displayTimeUnit='ms'), f)
+        return len(events)
+
+
+def format_timings(timings):
+    # Stage totals as a short status line, e.g. "evaluate 12.1 ms · serialize 3.0 ms"
+    return " · ".join(f"{name} {timings[name]:.1f} ms" for name in STAGES if name in timings)
+
+
+def configure_logging(level=None):
+    # Called once per process (the app, the batch renderer and its workers)
+    level = (level or os.environ.get('COMPLEX_PLOT_LOG_LEVEL') or DEFAULT_LOG_LEVEL).upper()
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    return level
+
+
+# Shared by everything in this process
+tracer = Tracer()
+span = tracer.span
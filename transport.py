@@ -0,0 +1,133 @@
+import base64
+import json
+import struct
+
+import numpy as np
+
+# Precision of the surface values and of the phase colouring sent to the web views.
+# Integer phase encodings are quantized over [-1, 1] (phase in π units).
+TRANSPORT_MODES = {
+    'float32': dict(values='float32', phase='float32'),
+    'float32, uint16 phase': dict(values='float32', phase='uint16'),
+    'float32, uint8 phase': dict(values='float32', phase='uint8'),
+    'float64': dict(values='float64', phase='float64'),
+}
+
+DEFAULT_TRANSPORT = 'float32'
+
+# Type codes plotly.js understands for base64 typed arrays (float16 is not one of them)
+TYPED_ARRAY_CODES = {
+    'float32': 'f4', 'float64': 'f8',
+    'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2', 'int32': 'i4', 'uint32': 'u4'
+}
+
+
+def transport_mode(name):
+    return TRANSPORT_MODES.get(name, TRANSPORT_MODES[DEFAULT_TRANSPORT])
+
+
+def phase_range(dtype):
+    # Range of the encoded phase values, used as cmin/cmax of the colour scale
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return -1.0, 1.0
+    return 0, int(np.iinfo(dtype).max)
+
+
+def encode_values(values, dtype):
+    return np.ascontiguousarray(values, dtype=dtype)
+
+
+def encode_phase(phase, dtype):
+    # Phase (in π units) as floats, or quantized linearly over [-1, 1] into an integer type
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return encode_values(phase, dtype)
+
+    top = np.iinfo(dtype).max
+    scaled = (np.nan_to_num(phase, nan=0.0) + 1.0) * (top / 2.0)
+    return np.clip(np.rint(scaled), 0, top).astype(dtype)
+
+
+def encode_phase_ticks(tickvals, dtype):
+    low, high = phase_range(dtype)
+    return [low + (value + 1.0) / 2.0 * (high - low) for value in tickvals]
+
+
+def typed_array(array):
+    # plotly.js typed array spec: raw little-endian bytes as base64 plus dtype and shape
+    array = np.ascontiguousarray(array)
+    if array.dtype.byteorder == '>':
+        array = array.astype(array.dtype.newbyteorder('<'))
+
+    spec = dict(
+        dtype=TYPED_ARRAY_CODES[array.dtype.name],
+        bdata=base64.b64encode(array.tobytes()).decode('ascii')
+    )
+    if array.ndim > 1:
+        spec['shape'] = ', '.join(str(size) for size in array.shape)
+    return spec
+
+
+class TransportEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, np.ndarray):
+            if obj.dtype.name in TYPED_ARRAY_CODES:
+                return typed_array(obj)
+            if obj.dtype.kind == 'f':
+                return typed_array(obj.astype(np.float64))
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return super().default(obj)
+
+
+class BufferEncoder(TransportEncoder):
+    # Arrays become {"dtype", "shape", "offset", "length"} references into raw bytes collected
+    # in buffers, instead of base64 inside the JSON
+
+    def __init__(self, buffers, **kwargs):
+        super().__init__(**kwargs)
+        self.buffers = buffers
+        self.offset = 0
+
+    def default(self, obj):
+        if isinstance(obj, np.ndarray) and obj.dtype.kind in 'iuf':
+            if obj.dtype.name not in TYPED_ARRAY_CODES:
+                obj = obj.astype(np.float64)
+            array = np.ascontiguousarray(obj, dtype=obj.dtype.newbyteorder('<'))
+            data = array.tobytes()
+            spec = dict(dtype=TYPED_ARRAY_CODES[array.dtype.name], offset=self.offset, length=len(data))
+            if array.ndim > 1:
+                spec['shape'] = ', '.join(str(size) for size in array.shape)
+            self.buffers.append(data)
+            self.offset += len(data)
+            return spec
+        return super().default(obj)
+
+
+def figures_to_binary(figures):
+    # All figures as one JSON document plus the raw bytes of their arrays: the body of a binary
+    # message (see pack_message). Returns (json bytes, array bytes).
+    # The figures' own data and layout: to_plotly_json() would deep copy them and turn every
+    # array into base64 before the encoder gets to see it
+    buffers = []
+    document = json.dumps({name: dict(data=figure._data, layout=figure._layout) for name, figure in figures.items()},
+                          cls=BufferEncoder, buffers=buffers, separators=(',', ':'))
+    return document.encode('utf-8'), b''.join(buffers)
+
+
+def pack_message(meta, document, data):
+    # <meta length><meta JSON><document length><document JSON><array bytes>, lengths as
+    # little-endian uint32; array offsets in the document count from the start of the array bytes
+    meta = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+    return struct.pack('<I', len(meta)) + meta + struct.pack('<I', len(document)) + document + data
+
+
+def figure_to_json(figure, keep=()):
+    # Serialize a figure with every numpy array sent as a base64 typed array.
+    # Traces whose index is in keep are sent as {"keep": index}, so the page reuses the trace it shows
+    figure_json = figure.to_plotly_json()
+    for index in keep:
+        figure_json['data'][index] = dict(keep=index)
+    return json.dumps(figure_json, cls=TransportEncoder, separators=(',', ':'))
@@ -0,0 +1,122 @@
+import logging
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, QUrl, QUrlQuery, pyqtSignal
+from PyQt5.QtWebEngineCore import QWebEngineUrlRequestJob, QWebEngineUrlScheme, QWebEngineUrlSchemeHandler
+from PyQt5.QtWebEngineWidgets import QWebEnginePage, QWebEngineProfile, QWebEngineView
+
+from assets import HOST, SCHEME, asset_store, data_path, install_static_assets
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+def register_plot_scheme():
+    # Must run before the QApplication is created
+    scheme = QWebEngineUrlScheme(SCHEME.encode())
+    scheme.setSyntax(QWebEngineUrlScheme.Host)
+    flags = QWebEngineUrlScheme.SecureScheme | QWebEngineUrlScheme.LocalAccessAllowed
+    if hasattr(QWebEngineUrlScheme, 'CorsEnabled'):
+        # Needed for fetch() on custom schemes (Qt 5.14+)
+        flags |= QWebEngineUrlScheme.CorsEnabled
+    scheme.setFlags(flags)
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+
+class PlotSchemeHandler(QWebEngineUrlSchemeHandler):
+    # Serves the asset store; nothing is read from or written to disk
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+
+    def requestStarted(self, job):
+        url = job.requestUrl()
+        # Figure data is requested by revision (see AssetStore.url), static assets without one
+        revision = QUrlQuery(url).queryItemValue('rev')
+        asset = self.store.get(url.path(), int(revision) if revision.isdigit() else None) if url.host() == HOST else None
+        if asset is None:
+            job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+            return
+
+        mime_type, data = asset
+        # The buffer is parented to the job, so it is freed together with the request
+        buffer = QBuffer(job)
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.ReadOnly)
+        job.reply(mime_type.encode(), buffer)
+
+
+_scheme_handler = None
+
+
+def install_scheme_handler():
+    global _scheme_handler
+    if _scheme_handler is None:
+        install_static_assets(asset_store)
+        _scheme_handler = PlotSchemeHandler(asset_store)
+        QWebEngineProfile.defaultProfile().installUrlSchemeHandler(SCHEME.encode(), _scheme_handler)
+
+
+class PlotPage(QWebEnginePage):
+    # Reports the redraw timings logged by the bootstrap page
+
+    # Total redraw time in ms, from handing over the data until Plotly.react resolved
+    redrawn = pyqtSignal(float)
+
+    def __init__(self, name, parent=None):
+        super().__init__(parent)
+        self.name = name
+        self.started = None
+
+    def javaScriptConsoleMessage(self, level, message, line, source):
+        if message.startswith('redraw '):
+            fetch_ms, react_ms = message.split()[1:]
+            if self.started is None:
+                return
+            duration = tracer.now_us() - self.started
+            tracer.add('redraw', self.started, duration, view=self.name, fetch_ms=float(fetch_ms), react_ms=float(react_ms))
+            logger.info("Redraw latency for %s: %.1f ms (fetch %s ms, Plotly.react %s ms)",
+                        self.name, duration / 1000, fetch_ms, react_ms)
+            self.redrawn.emit(duration / 1000)
+        else:
+            logger.debug("%s page: %s", self.name, message)
+
+
+class PlotView(QWebEngineView):
+    # A web view that keeps one Plotly page alive and redraws it with Plotly.react,
+    # so updates keep the camera and never reload plotly.js or the WebGL context
+
+    def __init__(self, name, parent=None):
+        super().__init__(parent)
+        install_scheme_handler()
+
+        self.name = name
+        self.ready = False
+        self.pending = None
+        self.setPage(PlotPage(name, self))
+        self.redrawn = self.page().redrawn
+        self.loadFinished.connect(self.on_load_finished)
+        self.load_started = tracer.now_us()
+        self.load(QUrl(f"{SCHEME}://{HOST}/index.html"))
+
+    def on_load_finished(self, ok):
+        self.ready = ok
+        tracer.add('page_load', self.load_started, tracer.now_us() - self.load_started, view=self.name, ok=ok)
+        if not ok:
+            logger.error("Plot page for %s failed to load", self.name)
+            return
+        if self.pending is not None:
+            payload, self.pending = self.pending, None
+            self.show_figure(payload)
+
+    def show_figure(self, payload):
+        # payload is the figure JSON; until the page is ready only the newest one is kept
+        if not self.ready:
+            self.pending = payload
+            return
+
+        # The data blob replaces the previous one in memory and is fetched by the page
+        path = data_path(self.name)
+        asset_store.put(path, 'application/json', payload)
+        self.page().started = tracer.now_us()
+        self.page().runJavaScript(f"loadPlot('{asset_store.url(path)}')")
@@ -0,0 +1,105 @@
+import logging
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from plotting import RenderCancelled, render_progressive
+
+logger = logging.getLogger(__name__)
+
+
+class RenderSignals(QObject):
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+    done = pyqtSignal(int)
+
+
+class RenderJob(QRunnable):
+    # Runs one render on a pool thread; only plain data crosses back to the UI thread.
+    # The render yields one result per refinement level, each delivered as it is ready.
+
+    def __init__(self, job_id, settings, render=render_progressive):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.job_id = job_id
+        self.settings = settings
+        self.render = render
+        self.cancel_event = threading.Event()
+        self.signals = RenderSignals()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            if self.cancel_event.is_set():
+                return
+            for result in self.render(self.settings, self.cancel_event.is_set):
+                if self.cancel_event.is_set():
+                    break
+                self.signals.finished.emit(self.job_id, result)
+        except RenderCancelled:
+            pass
+        except Exception as e:
+            logger.exception("Render failed")
+            self.signals.failed.emit(self.job_id, str(e))
+        finally:
+            self.signals.done.emit(self.job_id)
+
+
+class RenderPipeline(QObject):
+    # Submits renders to a background pool; a newer request cancels every older one,
+    # so only the result of the latest request is ever delivered
+
+    result_ready = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    busy_changed = pyqtSignal(bool)
+
+    def __init__(self, parent=None, render=render_progressive):
+        super().__init__(parent)
+        self.render = render
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.jobs = {}
+        self.latest_job_id = 0
+
+    def submit(self, settings):
+        self.cancel_all()
+
+        self.latest_job_id += 1
+        job = RenderJob(self.latest_job_id, settings, self.render)
+        job.signals.finished.connect(self.on_finished)
+        job.signals.failed.connect(self.on_failed)
+        job.signals.done.connect(self.on_done)
+
+        # Keep a reference until the job is done, the pool does not own the Python object
+        was_busy = bool(self.jobs)
+        self.jobs[job.job_id] = job
+        self.pool.start(job)
+        if not was_busy:
+            self.busy_changed.emit(True)
+        return job.job_id
+
+    def cancel_all(self):
+        for job in self.jobs.values():
+            job.cancel()
+
+    def is_busy(self):
+        return bool(self.jobs)
+
+    def on_finished(self, job_id, result):
+        if job_id == self.latest_job_id:
+            self.result_ready.emit(result)
+
+    def on_failed(self, job_id, message):
+        if job_id == self.latest_job_id:
+            self.failed.emit(message)
+
+    def on_done(self, job_id):
+        self.jobs.pop(job_id, None)
+        if not self.jobs:
+            self.busy_changed.emit(False)
+
+    def shutdown(self):
+        self.cancel_all()
+        self.pool.waitForDone()